@@ -0,0 +1,200 @@
+library std;
+  use std.env.all;
+
+library ieee;
+  use ieee.std_logic_1164.all;
+  use ieee.numeric_std.all;
+  use work.wb_pkg.all;
+
+-- Runs wb_debug against a host client connected through wb-debug-cosim. Command
+-- bytes are fed in and responses taken out one every byte_cycles clocks, so
+-- the client sees the same ordering and dropped bytes as over the UART, only
+-- faster. Simulation time only advances while the client has commands queued.
+
+entity tb_wb_debug_cosim is
+  generic (
+    byte_cycles : positive := 8
+  );
+end entity tb_wb_debug_cosim;
+
+architecture behave of tb_wb_debug_cosim is
+
+  constant clk_period : time := 10 ns;
+
+  -- Must match BATCH_SIZE in wb-debug-cosim
+  constant batch_size : positive := 4096;
+
+  subtype batch_t is string(1 to batch_size);
+
+  signal clk : std_logic := '0';
+  signal rst : std_logic := '1';
+
+  signal wb_controller : wb_controller_a20d16_t;
+  signal wb_target     : wb_target_d16_t;
+
+  signal sram_addr    : std_logic_vector(19 downto 0);
+  signal sram_data_wr : std_logic_vector(15 downto 0);
+  signal sram_data_rd : std_logic_vector(15 downto 0);
+  signal sram_we      : std_logic;
+
+  signal cmd          : std_logic_vector(7 downto 0);
+  signal cmd_valid    : std_logic;
+  signal data_consume : std_logic;
+  signal data         : std_logic_vector(7 downto 0);
+  signal data_valid   : std_logic;
+
+  procedure wb_debug_send (
+    bytes : in batch_t;
+    count : in integer
+  ) is
+  begin
+
+    assert false
+      report "Not reachable"
+      severity failure;
+
+  end procedure wb_debug_send;
+
+  procedure wb_debug_recv (
+    bytes : out batch_t;
+    count : out integer
+  ) is
+  begin
+
+    assert false
+      report "Not reachable"
+      severity failure;
+
+  end procedure wb_debug_recv;
+
+  attribute foreign of wb_debug_send : procedure is "VHPIDIRECT wb_debug_send";
+  attribute foreign of wb_debug_recv : procedure is "VHPIDIRECT wb_debug_recv";
+
+begin
+
+  clk <= not clk after clk_period / 2;
+
+  u_wb_debug : entity work.wb_debug
+    port map (
+      clk_i => clk,
+      rst_i => rst,
+
+      wb_controller_o => wb_controller,
+      wb_target_i     => wb_target,
+
+      cmd_i          => cmd,
+      cmd_valid_i    => cmd_valid,
+      data_consume_i => data_consume,
+      data_o         => data,
+      data_valid_o   => data_valid
+    );
+
+  u_sim_sram : entity work.sim_sram
+    port map (
+      clk_i => clk,
+      rst_i => rst,
+
+      sram_addr_i => sram_addr,
+      sram_data_i => sram_data_wr,
+      sram_data_o => sram_data_rd,
+      sram_we_i   => sram_we
+    );
+
+  u_wb_sram : entity work.wb_sram
+    generic map (
+      addr_width => 20,
+      data_width => 16
+    )
+    port map (
+      clk_i => clk,
+      rst_i => rst,
+
+      wb_controller_i => wb_controller,
+      wb_target_o     => wb_target,
+
+      sram_addr_o => sram_addr,
+      sram_dat_o  => sram_data_wr,
+      sram_dat_i  => sram_data_rd,
+      sram_sel_o  => open,
+      sram_we_o   => sram_we
+    );
+
+  bridge_p : process is
+
+    variable rx_bytes : batch_t;
+    variable rx_count : integer;
+    variable rx_next  : positive;
+    variable rx_wait  : natural;
+
+    variable tx_bytes : batch_t;
+    variable tx_count : natural;
+    variable tx_wait  : natural;
+
+    variable idle : natural;
+
+  begin
+
+    data_consume <= '0';
+    cmd          <= (others => '0');
+    cmd_valid    <= '0';
+
+    rx_count := 0;
+    rx_next  := 1;
+    rx_wait  := 0;
+    tx_count := 0;
+    tx_wait  := 0;
+    idle     := 0;
+
+    rst <= '1';
+    wait for clk_period;
+    rst <= '0';
+
+    loop
+
+      wait until rising_edge(clk);
+      cmd_valid    <= '0';
+      data_consume <= '0';
+      idle         := idle + 1;
+
+      if (tx_wait > 0) then
+        tx_wait := tx_wait - 1;
+      elsif (data_valid = '1') then
+        tx_count           := tx_count + 1;
+        tx_bytes(tx_count) := character'val(to_integer(unsigned(data)));
+        data_consume       <= '1';
+        tx_wait            := byte_cycles - 1;
+        idle               := 0;
+        if (tx_count = batch_size) then
+          wb_debug_send(tx_bytes, tx_count);
+          tx_count := 0;
+        end if;
+      end if;
+
+      if (rx_wait > 0) then
+        rx_wait := rx_wait - 1;
+      elsif (rx_next <= rx_count) then
+        cmd       <= std_logic_vector(to_unsigned(character'pos(rx_bytes(rx_next)), 8));
+        cmd_valid <= '1';
+        rx_next   := rx_next + 1;
+        rx_wait   := byte_cycles - 1;
+        idle      := 0;
+      elsif (idle >= 2 * byte_cycles) then
+        -- Everything received has been handled, so the client is waiting on
+        -- these responses before it sends more
+        if (tx_count > 0) then
+          wb_debug_send(tx_bytes, tx_count);
+          tx_count := 0;
+        end if;
+        wb_debug_recv(rx_bytes, rx_count);
+        exit when rx_count < 0;
+        rx_next := 1;
+        idle    := 0;
+      end if;
+
+    end loop;
+
+    finish;
+
+  end process bridge_p;
+
+end architecture behave;
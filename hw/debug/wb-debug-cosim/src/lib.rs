@@ -0,0 +1,79 @@
+use std::env;
+use std::fs;
+use std::io::{ErrorKind, Read, Write};
+use std::os::unix::net::{UnixListener, UnixStream};
+use std::slice;
+use std::sync::{LazyLock, Mutex};
+
+static STATE: LazyLock<Mutex<State>> = LazyLock::new(|| Mutex::new(State::new()));
+
+struct State {
+    listener: UnixListener,
+    stream: Option<UnixStream>,
+}
+
+// Must match batch_t in tb_wb_debug_cosim.vhd
+const BATCH_SIZE: usize = 4096;
+const SOCKET_ENV: &str = "J63_WB_DEBUG_SOCKET";
+const DEFAULT_SOCKET: &str = "build/j63_nvc/tb_wb_debug_cosim/tb_wb_debug_cosim.sock";
+
+impl State {
+    fn new() -> Self {
+        let path = env::var(SOCKET_ENV).unwrap_or(DEFAULT_SOCKET.to_string());
+        // A socket left behind by an earlier run would make bind fail
+        let _ = fs::remove_file(&path);
+        let listener = UnixListener::bind(&path).unwrap();
+        println!("wb_debug cosim listening on {}", path);
+        Self {
+            listener,
+            stream: None,
+        }
+    }
+
+    // The first transfer waits for the client to connect
+    fn stream(&mut self) -> &mut UnixStream {
+        if self.stream.is_none() {
+            let (stream, _) = self.listener.accept().unwrap();
+            self.stream = Some(stream);
+        }
+        self.stream.as_mut().unwrap()
+    }
+}
+
+#[unsafe(no_mangle)]
+pub extern "C" fn wb_debug_send(data: *const u8, count: i32) {
+    let data = unsafe { slice::from_raw_parts(data, count as usize) };
+    let mut state = STATE.lock().unwrap();
+    if let Err(error) = state.stream().write_all(data) {
+        println!("Warning, dropping {} response bytes: {}", count, error);
+    }
+}
+
+// Blocks until the client sends at least one byte, count is -1 once it has
+// disconnected
+#[unsafe(no_mangle)]
+pub extern "C" fn wb_debug_recv(data: *mut u8, count: *mut i32) {
+    let data = unsafe { slice::from_raw_parts_mut(data, BATCH_SIZE) };
+    let mut state = STATE.lock().unwrap();
+    let received = loop {
+        match state.stream().read(data) {
+            Ok(0) => break -1,
+            Ok(n) => break n as i32,
+            Err(error) if error.kind() == ErrorKind::Interrupted => continue,
+            Err(error) => {
+                println!("Warning, wb_debug client link failed: {}", error);
+                break -1;
+            }
+        }
+    };
+    unsafe { *count = received };
+}
+
+#[unsafe(no_mangle)]
+pub extern "C" fn startup() {
+    println!("Initializing wb_debug cosim");
+    drop(STATE.lock().unwrap());
+}
+
+#[unsafe(no_mangle)]
+pub static vhpi_startup_routines: [Option<unsafe extern "C" fn()>; 2] = [Some(startup), None];
@@ -2,7 +2,14 @@ library ieee;
   use ieee.std_logic_1164.all;
   use ieee.numeric_std.all;
 
+-- Behavioural SRAM model. The contents can be preloaded from a raw image of
+-- big-endian 16-bit words, as written by tools/sram_image.py; words past the
+-- end of the image start undefined.
+
 entity sim_sram is
+  generic (
+    init_file : string := ""
+  );
   port (
     clk_i : in    std_logic;
     rst_i : in    std_logic;
@@ -20,7 +27,45 @@ architecture behave of sim_sram is
 
   type memory_array is array (0 to word_count) of std_logic_vector(15 downto 0);
 
-  signal memory : memory_array;
+  type byte_file is file of character;
+
+  impure function load_memory (
+    path : string
+  ) return memory_array is
+
+    file     image  : byte_file;
+    variable status : file_open_status;
+    variable hi     : character;
+    variable lo     : character;
+    variable result : memory_array;
+
+  begin
+
+    if (path'length = 0) then
+      return result;
+    end if;
+
+    file_open(status, image, path, read_mode);
+    assert status = open_ok
+      report "Cannot open SRAM image " & path
+      severity failure;
+
+    for i in result'range loop
+
+      exit when endfile(image);
+      read(image, hi);
+      read(image, lo);
+      result(i) := std_logic_vector(to_unsigned(character'pos(hi), 8)) &
+                   std_logic_vector(to_unsigned(character'pos(lo), 8));
+
+    end loop;
+
+    file_close(image);
+    return result;
+
+  end function load_memory;
+
+  signal memory : memory_array := load_memory(init_file);
 
 begin
 
@@ -7,6 +7,11 @@ library ieee;
   use work.wb_pkg.all;
 
 entity tb_gpu is
+  generic (
+    -- Framebuffers and z-buffer, generated by build.py from PNG assets and
+    -- passed in when it elaborates the testbench
+    sram_image : string := ""
+  );
 end entity tb_gpu;
 
 architecture behave of tb_gpu is
@@ -117,6 +122,9 @@ begin
     );
 
   u_sim_sram : entity work.sim_sram
+    generic map (
+      init_file => sram_image
+    )
     port map (
       clk_i => clk_sys,
       rst_i => rst_sys,
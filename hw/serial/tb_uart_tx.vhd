@@ -4,14 +4,19 @@ library std;
 library ieee;
   use ieee.std_logic_1164.all;
   use ieee.numeric_std.all;
+  use ieee.math_real.all;
 
 entity tb_uart_tx is
+  generic (
+    baud_period_ns : positive := 4340; -- 230.400 kHz
+    seed           : positive := 1
+  );
 end entity tb_uart_tx;
 
 architecture behave of tb_uart_tx is
 
-  constant clk_period  : time := 10 ns;   -- 100 MHz
-  constant baud_period : time := 4340 ns; -- 230.400 kHz
+  constant clk_period  : time := 10 ns; -- 100 MHz
+  constant baud_period : time := baud_period_ns * 1 ns;
 
   signal clk : std_logic := '0';
   signal rst : std_logic := '1';
@@ -91,8 +96,15 @@ begin
 
     end procedure uart_read;
 
+    variable seed_1 : positive;
+    variable seed_2 : positive;
+    variable random : real;
+
   begin
 
+    seed_1 := seed;
+    seed_2 := 1;
+
     data_valid <= '0';
     data       <= (others => '0');
 
@@ -111,6 +123,15 @@ begin
     uart_read(8x"00");
     uart_read(8x"FF");
 
+    for i in 1 to 16 loop
+
+      uniform(seed_1, seed_2, random);
+      wait for clk_period * integer(floor(random * 100.0));
+      uniform(seed_1, seed_2, random);
+      uart_read(std_logic_vector(to_unsigned(integer(floor(random * 256.0)), 8)));
+
+    end loop;
+
     finish;
 
   end process stimulus_p;
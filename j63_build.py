@@ -0,0 +1,3000 @@
+import argparse
+import contextlib
+import dataclasses
+import fcntl
+import functools
+import graphlib
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import tomli_w
+
+
+@dataclasses.dataclass
+class Tasks:
+    dependencies: dict
+    builders: dict
+    resources: dict
+    batches: dict
+    outputs: dict
+    lazy: list
+
+
+# cpus are scheduler slots, memory is in MiB. Tasks sharing an exclusive tag
+# never run at the same time.
+@dataclasses.dataclass(frozen=True)
+class Resources:
+    cpus: int = 1
+    memory: int = 512
+    exclusive: str | None = None
+
+
+PYTHON_SOURCES = [
+    "build.py",
+    "j63_build.py",
+    "tools/sram_image.py",
+    "tools/uart_debug.py",
+    "tools/wb_debug_client.py",
+    "tools/wb_debug_cosim_test.py",
+    "tools/wb_debug_emulator.py",
+]
+VHDL_ROOT = "hw"
+QUARTUS_TOPLEVEL = "hw/quartus/j63_toplevel.vhd"
+QUARTUS_PROJECT_FILES = [
+    "hw/quartus/j63.qpf",
+    "hw/quartus/j63.qsf",
+    "hw/quartus/j63.sdc",
+    "hw/quartus/sys_pll.qip",
+    "hw/quartus/vga_pll.qip",
+    "hw/quartus/vga_fb_fifo.qip",
+]
+VSG_EXCLUDED = [
+    "hw/quartus/sys_pll.vhd",
+    "hw/quartus/vga_pll.vhd",
+    "hw/quartus/vga_fb_fifo.vhd",
+]
+GHDL_EXCLUDED = VSG_EXCLUDED
+QUARTUS_BUILD_DIR = "build/j63_quartus"
+QUARTUS_INPUT_DIR = "build/j63_quartus_inputs"
+QUARTUS_STAGES = ["map", "fit", "asm", "sta"]
+QUARTUS_STAGE_SETTINGS = [
+    (None, re.compile(r"-name (LAST_QUARTUS_VERSION|PROJECT_CREATION_TIME_DATE)\b")),
+    (None, re.compile(r"-name (PARTITION_COLOR|NUM_PARALLEL_PROCESSORS)\b")),
+    ("fit", re.compile(r"^set_location_assignment\b")),
+    ("fit", re.compile(r"-name (\w*IO_STANDARD|CURRENT_STRENGTH_NEW|SLEW_RATE)\b")),
+    ("fit", re.compile(r"-name (FITTER_\w+|PLACEMENT_\w+|ROUTER_\w+|SEED)\b")),
+    ("fit", re.compile(r"-name (OPTIMIZE_\w+_TIMING|RESERVE_\w+|WEAK_PULL_UP\w*)\b")),
+    ("fit", re.compile(r"-name PARTITION_FITTER_PRESERVATION_LEVEL\b")),
+    ("asm", re.compile(r"-name (GENERATE_\w+_FILE|ON_CHIP_BITSTREAM_\w+)\b")),
+    ("asm", re.compile(r"-name (USE_CONFIGURATION_DEVICE|\w+_CONFIGURATION_SCHEME)\b")),
+    ("sta", re.compile(r"-name (TIMING_ANALYZER_\w+|TIMEQUEST_\w+|SDC_FILE)\b")),
+]
+QUARTUS_PARALLEL_RE = re.compile(r"-name NUM_PARALLEL_PROCESSORS\b")
+QUARTUS_COMPILE_MODES = ["full", "smart", "incremental"]
+QUARTUS_SWEEP_DIR = "build/j63_quartus_sweep"
+QUARTUS_SWEEP_SEEDS = [1, 2, 3, 4]
+QUARTUS_SWEEP_EFFORTS = {
+    "standard": {},
+    "high": {
+        "PLACEMENT_EFFORT_MULTIPLIER": "4.0",
+        "ROUTER_TIMING_OPTIMIZATION_LEVEL": "MAXIMUM",
+    },
+}
+QUARTUS_SWEEP_TIMEOUT = 3600
+SBY_STATUS = {0: "PASS", 2: "FAIL", 4: "UNKNOWN", 8: "TIMEOUT"}
+SBY_TASK_PREFIX_RE = re.compile(r"^(~?\w+(?:\s+~?\w+)*)\s*:\s*(.*)$")
+SBY_STEP_RE = re.compile(r"\b(?:Checking|Reached) .* in step (\d+)")
+SBY_TIME_RE = re.compile(r"Elapsed clock time \[H:MM:SS \(secs\)\]: \S+ \((\d+)\)")
+ESTIMATE_DIR = "build/estimate"
+ESTIMATE_FAMILY = "cyclone10lp"
+ESTIMATE_GROWTH = 0.1
+ESTIMATE_CELLS = {
+    "lut": re.compile(r"lcell_comb$|^\$lut$"),
+    "ff": re.compile(r"^dffeas$|^\$_\w*DFF\w*_$|dff$"),
+    "ram": re.compile(r"altsyncram|ram_block|^\$mem"),
+}
+YOSYS_LTP_RE = re.compile(r"Longest topological path in \S+ \(length=(\d+)\)")
+GPU_COSIM_LIB = "hw/gpu/gpu-cosim/target/release/libgpucosim.so"
+WB_DEBUG_COSIM_LIB = "hw/debug/wb-debug-cosim/target/release/libwbdebugcosim.so"
+WB_DEBUG_SOCKET_ENV = "J63_WB_DEBUG_SOCKET"
+NVC_LIBRARY_DIR = "build/j63_nvc"
+NVC_TIME_RE = re.compile(r"\b(\d+)(fs|ps|ns|us|ms|sec)\+\d+:")
+NVC_TIME_UNITS = {"fs": 1e-6, "ps": 1e-3, "ns": 1, "us": 1e3, "ms": 1e6, "sec": 1e9}
+REGRESSION_DIR = "build/regression"
+REGRESSION_TIMEOUT = 600
+REGRESSION_TESTS = {
+    "tb_uart_rx": {
+        "generics": [{}, {"baud_period_ns": 8680}, {"baud_period_ns": 1085}],
+        "seeds": [1, 2, 3, 4],
+    },
+    "tb_uart_tx": {
+        "generics": [{}, {"baud_period_ns": 8680}, {"baud_period_ns": 1085}],
+        "seeds": [1, 2, 3, 4],
+    },
+    "tb_wb_debug": {},
+    "tb_gpu": {"timeout": 3600},
+}
+SRAM_IMAGES = {
+    "tb_gpu": {
+        "frame0": "hw/gpu/assets/colorbars.png",
+        "frame1": "hw/gpu/assets/gradient.png",
+    },
+}
+SIM_BENCH_DIR = "build/bench-sim"
+SIM_BENCH_HISTORY = os.environ.get("J63_BENCH_HISTORY", f"{SIM_BENCH_DIR}/history.json")
+SIM_BENCH_MODES = {
+    "O0": ["-O0"],
+    "O2": ["-O2"],
+    "O3": ["-O3"],
+    "jit": ["--jit"],
+}
+SIM_BENCH_CLOCK_PERIOD_NS = 10
+SIM_BENCH_THRESHOLD = 0.2
+BUILD_DB_FILE = "build/build-db.json"
+BUILD_DB_VERSION = 1
+FINGERPRINT_ENV = [
+    "QUARTUS_ROOTDIR",
+    "OSS_CAD_ROOTDIR",
+    "J63_QUARTUS_COMPILE",
+    "J63_WAVES",
+]
+NO_RESOURCES = Resources(cpus=0, memory=0)
+QUARTUS_RESOURCES = Resources(cpus=4, memory=8192, exclusive="quartus")
+QUARTUS_LIGHT_RESOURCES = Resources(cpus=1, memory=2048, exclusive="quartus")
+QUARTUS_GUI_RESOURCES = Resources(cpus=0, memory=0, exclusive="quartus")
+QUARTUS_SWEEP_RESOURCES = Resources(cpus=2, memory=3072)
+SIM_RESOURCES = Resources(cpus=1, memory=2048)
+SIM_BENCH_RESOURCES = Resources(cpus=1, memory=2048, exclusive="bench-sim")
+SBY_RESOURCES = Resources(cpus=1, memory=1024)
+YOSYS_RESOURCES = Resources(cpus=1, memory=1024)
+CARGO_RESOURCES = Resources(cpus=4, memory=2048)
+DEFAULT_TASK_DURATION = 1.0
+ARTIFACT_CACHE_DIR = os.environ.get(
+    "J63_BUILD_CACHE", os.path.expanduser("~/.cache/j63-build")
+)
+ARTIFACT_CACHE_SIZE = 20
+FICLONE = 0x40049409
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+WATCH_DIRS = ["hw", "tools"]
+WATCH_EXCLUDED = ["build", "target", ".git", "__pycache__"]
+WATCH_GRAPH_SUFFIXES = (".vhd", ".sby", ".rs")
+WATCH_DEBOUNCE = 0.1
+# The build's own no-op work, which grows with the design, took about 2 ms
+# when this was set. Whole runs add interpreter startup and imports, about
+# 100 ms with cached bytecode, which is why build.py only imports j63_build
+# and modules only needed once something runs are imported where they're used.
+NOOP_BUDGET = 0.05
+NOOP_RUN_BUDGET = 0.12
+NOOP_PHASES = [
+    "load db",
+    "scan VHDL",
+    "task graph",
+    "up-to-date check",
+    "save db",
+]
+WAVE_MODES = ["scoped", "none", "full"]
+GTKW_RANGE_RE = re.compile(r"\[[^\]]*\]$")
+GRAPH_BENCHMARK_SIZES = [100, 1000, 10000]
+GRAPH_BENCHMARK_SCALING = 3.0
+GRAPH_BENCHMARK_PHASES = [
+    "load db",
+    "scan VHDL",
+    "task graph",
+    "filter",
+    "up-to-date check",
+]
+VHDL_COMMENT_RE = re.compile(r"--.*")
+VHDL_ENTITY_RE = re.compile(r"^\s*entity\s+(\w+)\s+is\b", re.I | re.M)
+VHDL_UNIT_RE = re.compile(r"^\s*(?:entity|package)\s+(\w+)\s+is\b", re.I | re.M)
+VHDL_USE_RE = re.compile(r"\buse\s+work\.(\w+)", re.I)
+VHDL_ENTITY_INST_RE = re.compile(r"\bentity\s+work\.(\w+)", re.I)
+VHDL_COMPONENT_INST_RE = re.compile(
+    r"^\s*\w+\s*:\s*(?:component\s+)?(\w+)\s+(?:generic|port)\s+map\b", re.I | re.M
+)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s  %(message)s")
+    logging.info("Starting build")
+    args = parse_args()
+    if args.benchmark_graph:
+        benchmark_graph(args)
+        return
+
+    if args.task:
+        requested_tasks = args.task
+    else:
+        requested_tasks = ["all"]
+    if args.quartus_compile:
+        os.environ["J63_QUARTUS_COMPILE"] = args.quartus_compile
+    if args.waves:
+        os.environ["J63_WAVES"] = args.waves
+    if args.no_cache:
+        cache = None
+    else:
+        cache = ArtifactCache(args.cache_dir, int(args.cache_size * 1024**3))
+
+    db = BuildDb(BUILD_DB_FILE)
+    with contextlib.closing(db):
+        vhdl_tree, tasks = load_tasks(db, requested_tasks, args.shard)
+        if args.watch:
+            watch(args, db, cache, requested_tasks, vhdl_tree, tasks)
+        else:
+            build(args, db, cache, tasks)
+    if args.benchmark:
+        benchmark_noop(args, requested_tasks)
+
+
+def load_tasks(db, requested_tasks, shard):
+    vhdl_tree = scan_vhdl(db)
+    write_vhdl_ls(vhdl_tree)
+    tasks = filter_tasks(build_task_graph(vhdl_tree, shard), requested_tasks)
+    return vhdl_tree, tasks
+
+
+def build(args, db, cache, tasks):
+    TRACE.reset()
+    pool = ResourcePool(cpus=args.jobs, memory=args.memory)
+    try:
+        run_tasks(tasks, db, pool, cache)
+    finally:
+        TRACE.report(tasks, pool)
+        if cache is not None:
+            cache.report()
+        if args.trace:
+            TRACE.write(args.trace)
+
+
+def benchmark_noop(args, requested_tasks):
+    # The build above left everything up to date. Time whole no-op runs in
+    # fresh interpreters, then the phases of one in this process.
+    cmd = [sys.executable, sys.argv[0]] + requested_tasks
+    totals = []
+    for _ in range(args.benchmark):
+        start = time.perf_counter()
+        subprocess.run(cmd, stderr=subprocess.DEVNULL, check=True)
+        totals.append(time.perf_counter() - start)
+
+    phases = {}
+    in_process = []
+    logging.disable(logging.INFO)
+    for _ in range(args.benchmark):
+        TRACE.reset()
+        timings = [time.perf_counter()]
+        db = BuildDb(BUILD_DB_FILE)
+        timings.append(time.perf_counter())
+        vhdl_tree = scan_vhdl(db)
+        write_vhdl_ls(vhdl_tree)
+        timings.append(time.perf_counter())
+        tasks = filter_tasks(build_task_graph(vhdl_tree, args.shard), requested_tasks)
+        timings.append(time.perf_counter())
+        run_tasks(tasks, db, ResourcePool(cpus=args.jobs, memory=args.memory), None)
+        timings.append(time.perf_counter())
+        db.close()
+        timings.append(time.perf_counter())
+        for name, start, end in zip(NOOP_PHASES, timings, timings[1:]):
+            phases.setdefault(name, []).append(end - start)
+        in_process.append(timings[-1] - timings[0])
+    logging.disable(logging.NOTSET)
+
+    totals.sort()
+    median = totals[len(totals) // 2]
+    in_process_median = sorted(in_process)[len(in_process) // 2]
+    logging.info(
+        f"No-op build of {' '.join(requested_tasks)}: median {median * 1000:.1f} ms, "
+        f"min {totals[0] * 1000:.1f} ms, max {totals[-1] * 1000:.1f} ms "
+        f"over {len(totals)} runs"
+    )
+    logging.info(
+        f"In process: median {in_process_median * 1000:.1f} ms, "
+        + ", ".join(
+            f"{name} {sorted(x)[len(x) // 2] * 1000:.1f} ms"
+            for name, x in phases.items()
+        )
+    )
+    if in_process_median > NOOP_BUDGET:
+        fatal(f"No-op build is over the {NOOP_BUDGET * 1000:.0f} ms budget")
+    if median > NOOP_RUN_BUDGET:
+        fatal(f"No-op run is over the {NOOP_RUN_BUDGET * 1000:.0f} ms budget")
+
+
+def benchmark_graph(args):
+    # Time the no-op path on synthetic trees of growing size, each in a scratch
+    # directory holding the real top-levels over a generated hierarchy. Cost
+    # per file should stay flat as the tree grows.
+    import tempfile
+
+    roots = [QUARTUS_TOPLEVEL] + sorted(
+        str(x) for x in pathlib.Path(VHDL_ROOT).rglob("tb_*.vhd")
+    )
+    per_file = {}
+    for size in GRAPH_BENCHMARK_SIZES:
+        with tempfile.TemporaryDirectory() as tmp, contextlib.chdir(tmp):
+            write_synthetic_vhdl(size, roots)
+            logging.disable(logging.INFO)
+            mark_synthetic_built(args)
+            timings = time_synthetic_noop()
+            logging.disable(logging.NOTSET)
+        total = timings[-1] - timings[0]
+        per_file[size] = total / size
+        logging.info(
+            f"{size:>6} files: "
+            + ", ".join(
+                f"{name} {(end - start) * 1000:.1f} ms"
+                for name, start, end in zip(
+                    GRAPH_BENCHMARK_PHASES, timings, timings[1:]
+                )
+            )
+            + f", total {total * 1000:.1f} ms ({per_file[size] * 1e6:.1f} us/file)"
+        )
+
+    smallest = GRAPH_BENCHMARK_SIZES[0]
+    largest = GRAPH_BENCHMARK_SIZES[-1]
+    if per_file[largest] > GRAPH_BENCHMARK_SCALING * per_file[smallest]:
+        fatal(
+            f"Per-file cost grows {per_file[largest] / per_file[smallest]:.1f}x "
+            f"from {smallest} to {largest} files, "
+            f"limit is {GRAPH_BENCHMARK_SCALING:.1f}x"
+        )
+
+
+def write_synthetic_vhdl(size, roots):
+    # Entities form a tree with fan-out three, as design hierarchies do, and
+    # each one also instantiates a shared leaf and uses a package. Packages
+    # use one earlier package.
+    import random
+
+    rng = random.Random(size)
+    packages = [f"synth_pkg_{i}" for i in range(max(1, size // 20))]
+    entities = [f"synth_{i}" for i in range(size - len(packages))]
+    leaves = entities[len(entities) * 2 // 3 :]
+    units = {}
+    for i, name in enumerate(packages):
+        uses = [f"use work.{rng.choice(packages[:i])}.all;"] if i else []
+        units[name] = uses + [f"package {name} is", "end package;"]
+    for i, name in enumerate(entities):
+        children = entities[3 * i + 1 : 3 * i + 4]
+        if children:
+            children.append(rng.choice(leaves))
+        units[name] = synthetic_entity(name, rng.choice(packages), children)
+
+    for i, (name, lines) in enumerate(units.items()):
+        path = pathlib.Path(f"{VHDL_ROOT}/synth/{i // 100}/{name}.vhd")
+        mkdir(path.parent)
+        path.write_text("\n".join(lines) + "\n")
+    for root in roots:
+        name = pathlib.Path(root).stem
+        child = rng.choice(entities[: min(len(entities), 40)])
+        mkdir(pathlib.Path(root).parent)
+        pathlib.Path(root).write_text(
+            "\n".join(synthetic_entity(name, packages[0], [child])) + "\n"
+        )
+    for source in PYTHON_SOURCES + QUARTUS_PROJECT_FILES:
+        touch(source)
+
+
+def synthetic_entity(name, package, children):
+    return (
+        ["library ieee;", "use ieee.std_logic_1164.all;", f"use work.{package}.all;"]
+        + [f"entity {name} is", "end entity;", f"architecture rtl of {name} is"]
+        + ["begin"]
+        + [f"  u_{i} : entity work.{x};" for i, x in enumerate(children)]
+        + ["end architecture;"]
+    )
+
+
+def mark_synthetic_built(args):
+    # Stand in for a finished build: every task gets its output file and
+    # recorded fingerprint, without running any builder.
+    db = BuildDb(BUILD_DB_FILE)
+    tasks = filter_tasks(build_task_graph(scan_vhdl(db), args.shard), ["all"])
+    for task in graphlib.TopologicalSorter(tasks.dependencies).static_order():
+        builder = tasks.builders[task]
+        if builder is mkdir:
+            mkdir(task)
+        elif builder is not nop and not os.path.exists(task):
+            touch(task)
+        db.record_task(task, task_fingerprint(task, tasks, db))
+    db.close()
+
+
+def time_synthetic_noop():
+    timings = [time.perf_counter()]
+    db = BuildDb(BUILD_DB_FILE)
+    timings.append(time.perf_counter())
+    vhdl_tree = scan_vhdl(db)
+    timings.append(time.perf_counter())
+    graph = build_task_graph(vhdl_tree)
+    timings.append(time.perf_counter())
+    tasks = filter_tasks(graph, ["all"])
+    timings.append(time.perf_counter())
+    for task in graphlib.TopologicalSorter(tasks.dependencies).static_order():
+        fingerprint = task_fingerprint(task, tasks, db)
+        if tasks.builders[task] is not nop and not task_up_to_date(
+            task, fingerprint, db
+        ):
+            fatal(f"Synthetic build left {task} out of date")
+    timings.append(time.perf_counter())
+    return timings
+
+
+def watch(args, db, cache, requested_tasks, vhdl_tree, tasks):
+    watcher = FileWatcher(WATCH_DIRS)
+    build_and_continue(args, db, cache, tasks)
+    while True:
+        logging.info("Watching for changes")
+        changed = watcher.wait(WATCH_DEBOUNCE)
+        if changed & {"build.py", "j63_build.py"}:
+            logging.info("Build script changed, restarting")
+            db.close()
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+        for path in changed:
+            db.forget_file(path)
+        graph_changed = {x for x in changed if watch_graph_input(x)}
+        if graph_changed:
+            new_vhdl_tree = scan_vhdl(db)
+            known = {str(x) for x in tasks.dependencies}
+            sby_changed = any(x.endswith(".sby") for x in graph_changed)
+            if new_vhdl_tree != vhdl_tree or not graph_changed <= known or sby_changed:
+                logging.info("Reloading task graph")
+                vhdl_tree, tasks = load_tasks(db, requested_tasks, args.shard)
+
+        affected = downstream_tasks(tasks, changed)
+        if affected:
+            logging.info(f"Changed: {' '.join(sorted(changed))}")
+            build_and_continue(args, db, cache, filter_tasks(tasks, affected))
+
+
+def build_and_continue(args, db, cache, tasks):
+    try:
+        build(args, db, cache, tasks)
+    except SystemExit:
+        logging.error("Build failed")
+    db.close()
+
+
+def downstream_tasks(tasks, changed):
+    dependents = {}
+    for task, deps in tasks.dependencies.items():
+        for dep in deps:
+            dependents.setdefault(str(dep), []).append(task)
+
+    affected = set()
+    pending = list(changed)
+    while pending:
+        for task in dependents.get(str(pending.pop()), []):
+            if task not in affected:
+                affected.add(task)
+                pending.append(task)
+    return affected
+
+
+class FileWatcher:
+    def __init__(self, roots):
+        import ctypes
+
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            fatal(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        self.watches = {}
+        self.add_watch(".")
+        for root in roots:
+            self.add_tree(root)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def add_tree(self, root):
+        if watch_excluded(root):
+            return
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [x for x in dirnames if x not in WATCH_EXCLUDED]
+            self.add_watch(dirpath)
+
+    def read(self, timeout):
+        import select
+        import struct
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16 : offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            path = os.path.normpath(os.path.join(self.watches.get(wd, "."), name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+            elif not watch_excluded(path):
+                changed.add(path)
+        return changed
+
+    def wait(self, debounce):
+        changed = self.read(None)
+        while True:
+            more = self.read(debounce)
+            if not more:
+                return changed
+            changed.update(more)
+
+
+# Editors save through hidden files, like Emacs' .#name.vhd lock links, which
+# aren't sources even when the extension matches
+def watch_graph_input(path):
+    name = os.path.basename(path)
+    return name.endswith(WATCH_GRAPH_SUFFIXES) and not name.startswith(".")
+
+
+# Build outputs like a crate's target/ can sit anywhere in the tree
+def watch_excluded(path):
+    return any(x in WATCH_EXCLUDED for x in pathlib.PurePath(path).parts)
+
+
+def run_tasks(tasks, db, pool, cache):
+    task_iter = graphlib.TopologicalSorter(tasks.dependencies)
+    priorities = None
+    executor = None
+
+    # The worker pool and priorities, and the modules they need, are only set
+    # up once something has to run, which keeps a no-op build cheap.
+    with contextlib.ExitStack() as stack:
+
+        def build_task(task, fingerprint):
+            outputs = tasks.outputs.get(task)
+            if cache is None or not outputs or fingerprint is None:
+                tasks.builders[task](task=task, dependencies=tasks.dependencies[task])
+                return
+            outputs = outputs + [task]
+            key = cache.key(task, fingerprint)
+            if cache.restore(key, outputs):
+                logging.info(f"{task} restored from cache")
+                return
+            unshare_outputs(outputs)
+            tasks.builders[task](task=task, dependencies=tasks.dependencies[task])
+            cache.store(key, outputs)
+
+        def run_job(job):
+            task = job[0][0]
+            for member, _ in job:
+                db.forget_task(member)
+                TRACE.task_started(
+                    member, pool.demand(tasks.resources[member]), share=1 / len(job)
+                )
+            start = time.monotonic()
+            if tasks.batches.get(task) is None:
+                build_task(task, job[0][1])
+            else:
+                tasks.builders[task](batch=[(x, tasks.dependencies[x]) for x, _ in job])
+            duration = (time.monotonic() - start) / len(job)
+            rewrites_sources = tasks.builders[task] in (black_fix, ruff_fix, vsg_fix)
+            for member, fingerprint in job:
+                db.record_duration(member, duration)
+                TRACE.task_finished(member)
+                db.forget_file(member)
+                if rewrites_sources:
+                    # Record the fixed sources, or they look changed next time
+                    for dep in tasks.dependencies[member]:
+                        db.forget_file(dep)
+                    fingerprint = None
+                if fingerprint is None:
+                    fingerprint = task_fingerprint(member, tasks, db)
+                db.record_task(member, fingerprint)
+            return job
+
+        task_iter.prepare()
+        ready = []
+        running = {}
+        while task_iter.is_active():
+            up_to_date = []
+            for task in task_iter.get_ready():
+                if task not in tasks.builders:
+                    fatal(f"No rule to make {task}")
+                TRACE.task_ready(task)
+                fingerprint = task_fingerprint(task, tasks, db)
+                if task_up_to_date(task, fingerprint, db):
+                    logging.info(f"{task} up to date")
+                    TRACE.task_finished(task, up_to_date=True)
+                    up_to_date.append(task)
+                elif tasks.builders[task] is nop:
+                    db.record_task(task, fingerprint)
+                    TRACE.task_finished(task, up_to_date=True)
+                    up_to_date.append(task)
+                else:
+                    ready.append((task, fingerprint))
+            if up_to_date:
+                task_iter.done(*up_to_date)
+                continue
+
+            if executor is None:
+                import concurrent.futures
+
+                priorities = critical_path_lengths(tasks, db)
+                executor = stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=pool.total.cpus)
+                )
+            picked = pool.pick(ready, tasks.resources, priorities)
+            for job in batch_jobs(picked, ready, tasks.batches):
+                for entry in job:
+                    ready.remove(entry)
+                pool.acquire(tasks.resources[job[0][0]])
+                running[executor.submit(run_job, job)] = job
+
+            futures = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for completed in futures.done:
+                job = running.pop(completed)
+                pool.release(tasks.resources[job[0][0]])
+                task_iter.done(*(task for task, _ in completed.result()))
+
+
+def batch_jobs(picked, ready, batches):
+    # Each picked task is one worker slot. Ready tasks sharing a batch key are
+    # spread over the slots picked for that key and run as one command each.
+    slots = {}
+    for entry in picked:
+        slots.setdefault(batches.get(entry[0]), []).append(entry)
+
+    jobs = [[x] for x in slots.pop(None, [])]
+    for key, key_slots in slots.items():
+        members = [x for x in ready if batches.get(x[0]) == key]
+        jobs.extend(members[i :: len(key_slots)] for i in range(len(key_slots)))
+    return jobs
+
+
+def critical_path_lengths(tasks, db):
+    dependents = {task: [] for task in tasks.dependencies}
+    for task, deps in tasks.dependencies.items():
+        for dep in deps:
+            dependents.setdefault(dep, []).append(task)
+
+    lengths = {}
+    order = list(graphlib.TopologicalSorter(tasks.dependencies).static_order())
+    for task in reversed(order):
+        if tasks.resources.get(task) == NO_RESOURCES:
+            default_duration = 0.0
+        else:
+            default_duration = DEFAULT_TASK_DURATION
+        duration = db.task_duration(task, default_duration)
+        lengths[task] = duration + max(
+            (lengths[x] for x in dependents.get(task, [])), default=0.0
+        )
+    return lengths
+
+
+class BuildTrace:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        self.tasks = {}
+        self.threads = {}
+
+    def now(self):
+        return time.monotonic() - self.start
+
+    def thread_id(self):
+        with self.lock:
+            return self.threads.setdefault(threading.get_ident(), len(self.threads))
+
+    def task_ready(self, task):
+        with self.lock:
+            self.tasks[str(task)] = {
+                "ready": self.now(),
+                "start": None,
+                "end": None,
+                "cpu": 0.0,
+                "rss": 0,
+                "cpus": 0,
+                "share": 1.0,
+                "ran": False,
+                "trivial": False,
+            }
+
+    def task_started(self, task, resources, share=1.0):
+        self.local.task = str(task)
+        with self.lock:
+            record = self.tasks[str(task)]
+            record["start"] = self.now()
+            record["cpus"] = resources.cpus * share
+            record["share"] = share
+            record["ran"] = True
+            record["trivial"] = resources == NO_RESOURCES
+
+    def task_finished(self, task, up_to_date=False):
+        self.local.task = None
+        with self.lock:
+            record = self.tasks[str(task)]
+            record["end"] = self.now()
+            if up_to_date:
+                record["start"] = record["end"]
+                return
+        self.add_event(
+            name=str(task),
+            category="task",
+            start=record["start"],
+            end=record["end"],
+            args={
+                "queued_s": record["start"] - record["ready"],
+                "cpu_s": record["cpu"],
+                "peak_rss_mib": record["rss"] / 1024,
+            },
+        )
+
+    def command(self, cmd, start, usage):
+        cpu = usage.ru_utime + usage.ru_stime
+        task = getattr(self.local, "task", None)
+        if task is not None:
+            with self.lock:
+                record = self.tasks[task]
+                record["cpu"] += cpu
+                record["rss"] = max(record["rss"], usage.ru_maxrss)
+        self.add_event(
+            name=pathlib.Path(cmd[0]).name,
+            category="command",
+            start=start - self.start,
+            end=self.now(),
+            args={
+                "cmd": " ".join(cmd),
+                "task": task,
+                "cpu_s": cpu,
+                "peak_rss_mib": usage.ru_maxrss / 1024,
+            },
+        )
+
+    def add_event(self, name, category, start, end, args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": self.thread_id(),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self, path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            contents = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+        path.write_text(json.dumps(contents))
+        logging.info(f"Wrote build trace to {path}")
+
+    def report(self, tasks, pool):
+        wall = self.now()
+        with self.lock:
+            records = {x: y for x, y in self.tasks.items() if y["end"] is not None}
+        ran = {x: y for x, y in records.items() if y["ran"] and not y["trivial"]}
+        queued = sum(x["start"] - x["ready"] for x in ran.values())
+        # Members of a batch share one command, each is charged its part
+        running = sum((x["end"] - x["start"]) * x["share"] for x in ran.values())
+        busy = sum((x["end"] - x["start"]) * x["cpus"] for x in ran.values())
+        utilization = busy / (pool.total.cpus * wall) if wall > 0 else 0.0
+        logging.info(
+            f"Build took {wall:.2f}s: {len(ran)} tasks run, "
+            f"{len(records) - len(ran)} up to date"
+        )
+        if not ran:
+            return
+        logging.info(
+            f"Time queued {queued:.2f}s, running {running:.2f}s, "
+            f"worker utilization {utilization:.0%} of {pool.total.cpus} slots"
+        )
+        logging.info("Critical path:")
+        for task in self.critical_path(tasks, records):
+            if task in ran:
+                record = ran[task]
+                logging.info(
+                    f"  {record['end'] - record['start']:8.2f}s  "
+                    f"(+{record['start'] - record['ready']:.2f}s queued)  {task}"
+                )
+
+    def critical_path(self, tasks, records):
+        dependencies = {
+            str(x): [str(y) for y in deps] for x, deps in tasks.dependencies.items()
+        }
+        task = max(records, key=lambda x: records[x]["end"])
+        path = [task]
+        while True:
+            deps = [x for x in dependencies.get(task, []) if x in records]
+            if not deps:
+                break
+            task = max(deps, key=lambda x: records[x]["end"])
+            path.append(task)
+        path.reverse()
+        return path
+
+
+TRACE = BuildTrace()
+
+
+class ArtifactCache:
+    # Cached files are stored once under objects/ by content hash and each
+    # entries/<key>.json maps a task's output paths to them. Objects are
+    # read-only, so an output restored as a hardlink can't be written through
+    # to the cache by accident.
+    def __init__(self, root, max_size):
+        self.root = pathlib.Path(root)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.counter_lock = threading.Lock()
+        for subdir in ["objects", "entries", "tmp"]:
+            make_shared_dir(self.root / subdir)
+
+    # flock works on a read-only descriptor, so users who can't write the lock
+    # file can still take it
+    @contextlib.contextmanager
+    def locked(self, mode):
+        fd = os.open(self.root / "lock", os.O_RDONLY | os.O_CREAT, 0o664)
+        try:
+            try:
+                os.fchmod(fd, 0o664)
+            except PermissionError:
+                pass
+            fcntl.flock(fd, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def key(self, task, fingerprint):
+        return hashlib.sha256(f"{task}\0{fingerprint}".encode()).hexdigest()
+
+    def object_path(self, digest):
+        return self.root / "objects" / digest[:2] / digest
+
+    def entry_path(self, key):
+        return self.root / "entries" / f"{key}.json"
+
+    def restore(self, key, outputs):
+        with self.locked(fcntl.LOCK_SH):
+            try:
+                entry = json.loads(self.entry_path(key).read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.count(hit=False)
+                return False
+            for output in outputs:
+                remove_path(output)
+            try:
+                for path, (digest, mode) in entry["files"].items():
+                    clone_file(self.object_path(digest), path, mode)
+            except FileNotFoundError:
+                for output in outputs:
+                    remove_path(output)
+                self.count(hit=False)
+                return False
+            os.utime(self.entry_path(key))
+        self.count(hit=True)
+        return True
+
+    def store(self, key, outputs):
+        files = {}
+        with self.locked(fcntl.LOCK_EX):
+            for output in outputs:
+                for path in walk_files(output):
+                    digest = hash_file(path)
+                    mode = stat.S_IMODE(os.stat(path).st_mode)
+                    files[str(path)] = [digest, mode]
+                    object_path = self.object_path(digest)
+                    if object_path.exists():
+                        continue
+                    make_shared_dir(object_path.parent)
+                    tmp_path = self.tmp_path(digest)
+                    shutil.copyfile(path, tmp_path)
+                    os.chmod(tmp_path, 0o444)
+                    os.replace(tmp_path, object_path)
+            tmp_path = self.tmp_path(key)
+            tmp_path.write_text(json.dumps({"files": files}))
+            os.chmod(tmp_path, 0o664)
+            os.replace(tmp_path, self.entry_path(key))
+            self.evict()
+
+    def tmp_path(self, name):
+        return self.root / "tmp" / f"{name}.{os.getpid()}.{threading.get_ident()}"
+
+    def evict(self):
+        entries = sorted(
+            (self.root / "entries").glob("*.json"), key=lambda x: x.stat().st_mtime
+        )
+        references = {}
+        entry_objects = {}
+        for entry_path in entries:
+            try:
+                files = json.loads(entry_path.read_text())["files"]
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                files = {}
+            entry_objects[entry_path] = {x[0] for x in files.values()}
+            for digest in entry_objects[entry_path]:
+                references[digest] = references.get(digest, 0) + 1
+
+        sizes = {x.name: x.stat().st_size for x in (self.root / "objects").glob("*/*")}
+        dead = [x for x in sizes if references.get(x, 0) == 0]
+        live_size = sum(sizes.values()) - sum(sizes[x] for x in dead)
+        for entry_path in entries:
+            if live_size <= self.max_size:
+                break
+            entry_path.unlink(missing_ok=True)
+            for digest in entry_objects[entry_path]:
+                references[digest] -= 1
+                if references[digest] == 0 and digest in sizes:
+                    dead.append(digest)
+                    live_size -= sizes[digest]
+        for digest in dead:
+            self.object_path(digest).unlink(missing_ok=True)
+
+    def count(self, hit):
+        with self.counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def report(self):
+        if not self.hits and not self.misses:
+            return
+        stats_path = self.root / "stats.json"
+        with self.locked(fcntl.LOCK_EX):
+            try:
+                stats = json.loads(stats_path.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                stats = {"hits": 0, "misses": 0}
+            stats["hits"] += self.hits
+            stats["misses"] += self.misses
+            tmp_path = self.tmp_path("stats")
+            tmp_path.write_text(json.dumps(stats))
+            os.chmod(tmp_path, 0o664)
+            os.replace(tmp_path, stats_path)
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+            size = sum(x.stat().st_size for x in (self.root / "objects").glob("*/*"))
+        logging.info(
+            f"Artifact cache: {hits} hits, {misses} misses "
+            f"(all time {stats['hits']} hits, {stats['misses']} misses), "
+            f"{size / 1024**3:.2f} of {self.max_size / 1024**3:.2f} GiB used"
+        )
+
+
+def make_shared_dir(path):
+    path.mkdir(parents=True, exist_ok=True)
+    try:
+        os.chmod(path, 0o2775)
+    except PermissionError:
+        pass
+
+
+def clone_file(src, dst, mode):
+    dst = pathlib.Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            pass
+        else:
+            os.chmod(dst, mode)
+            return
+    try:
+        dst.unlink()
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+        os.chmod(dst, mode)
+
+
+def unshare_outputs(outputs):
+    # Outputs restored as hardlinks share their inode with the cache. Give the
+    # builder private copies before it gets to modify them in place. Links
+    # whose object was evicted since are private already, but still read-only.
+    for output in outputs:
+        for path in walk_files(output):
+            file_stat = os.stat(path)
+            mode = stat.S_IMODE(file_stat.st_mode) | stat.S_IWUSR
+            if file_stat.st_nlink > 1:
+                tmp_path = path.with_name(f"{path.name}.unshare")
+                shutil.copyfile(path, tmp_path)
+                os.chmod(tmp_path, mode)
+                os.replace(tmp_path, path)
+            elif not file_stat.st_mode & stat.S_IWUSR:
+                os.chmod(path, mode)
+
+
+def walk_files(path):
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return sorted(x for x in path.rglob("*") if x.is_file())
+    if path.is_file():
+        return [path]
+    return []
+
+
+def remove_path(path):
+    path = pathlib.Path(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class ResourcePool:
+    def __init__(self, cpus, memory):
+        self.total = Resources(cpus=cpus, memory=memory)
+        self.cpus = cpus
+        self.memory = memory
+        self.exclusive = set()
+
+    def demand(self, resources):
+        return dataclasses.replace(
+            resources,
+            cpus=min(resources.cpus, self.total.cpus),
+            memory=min(resources.memory, self.total.memory),
+        )
+
+    def pick(self, ready, resources, priorities):
+        # Walk ready tasks by remaining critical path. A task that doesn't fit
+        # still reserves its share, so lighter tasks can only backfill around
+        # it instead of starving it.
+        cpus = self.cpus
+        memory = self.memory
+        exclusive = set(self.exclusive)
+        picked = []
+        for task, fingerprint in sorted(
+            ready, key=lambda x: priorities.get(x[0], 0.0), reverse=True
+        ):
+            demand = self.demand(resources[task])
+            if (
+                demand.cpus <= cpus
+                and demand.memory <= memory
+                and demand.exclusive not in exclusive
+            ):
+                picked.append((task, fingerprint))
+            cpus -= demand.cpus
+            memory -= demand.memory
+            if demand.exclusive is not None:
+                exclusive.add(demand.exclusive)
+        return picked
+
+    def acquire(self, resources):
+        demand = self.demand(resources)
+        self.cpus -= demand.cpus
+        self.memory -= demand.memory
+        if demand.exclusive is not None:
+            self.exclusive.add(demand.exclusive)
+
+    def release(self, resources):
+        demand = self.demand(resources)
+        self.cpus += demand.cpus
+        self.memory += demand.memory
+        self.exclusive.discard(demand.exclusive)
+
+
+def build_task_graph(vhdl_tree, shard=(1, 1)):
+    dependencies = {}
+    builders = {}
+    resources = {}
+    batches = {}
+    outputs = {}
+    lazy_rules = []
+    closures = {}
+    vsg_sources = [x for x in vhdl_tree if x not in VSG_EXCLUDED]
+    quartus_sources = transitive_closure(QUARTUS_TOPLEVEL, vhdl_tree, closures)
+
+    def rule(name, builder, deps, task_resources=None, batch=None, task_outputs=None):
+        if task_resources is None:
+            if builder in (nop, file_exists, mkdir):
+                task_resources = NO_RESOURCES
+            else:
+                task_resources = Resources()
+        builders[name] = builder
+        dependencies[name] = deps
+        resources[name] = task_resources
+        batches[name] = batch
+        outputs[name] = task_outputs
+
+    # Subtrees that are costly to define are only expanded by filter_tasks
+    # once one of their names, or a name under one of their directories, is
+    # needed.
+    def lazy(names, definer):
+        lazy_rules.append((names, definer))
+
+    rule(
+        "all",
+        nop,
+        [
+            "vsg-check",
+            "black-check",
+            "ruff-check",
+            "build/j63_quartus/meta-built",
+            "build/j63_nvc/meta-run",
+        ],
+    )
+    rule("format", nop, ["vsg-fix", "black-fix", "ruff-fix"])
+    rule("sim", nop, ["build/j63_nvc/meta-run"])
+    define_lint(rule, "black-check", black_check, PYTHON_SOURCES)
+    define_lint(rule, "ruff-check", ruff_check, PYTHON_SOURCES)
+    define_lint(rule, "vsg-check", vsg_check, vsg_sources)
+    define_lint(rule, "black-fix", black_fix, PYTHON_SOURCES)
+    define_lint(rule, "ruff-fix", ruff_fix, PYTHON_SOURCES)
+    define_lint(rule, "vsg-fix", vsg_fix, vsg_sources)
+    define_quartus(rule, quartus_sources)
+    lazy(
+        ["estimate", f"{ESTIMATE_DIR}/"],
+        lambda: define_estimate(rule, vhdl_tree, closures, quartus_sources),
+    )
+    rule(
+        "quartus-j63",
+        open_quartus_project,
+        ["build/j63_quartus/meta-built"],
+        QUARTUS_GUI_RESOURCES,
+    )
+    rule(
+        "program",
+        lambda **kwargs: run(
+            [
+                f"{os.environ["QUARTUS_ROOTDIR"]}/bin/quartus_pgm",
+                "--cable=1",
+                "--mode=jtag",
+                "-o",
+                "p;./build/j63_quartus/j63.sof@1",
+            ],
+        ),
+        ["build/j63_quartus/meta-built"],
+        QUARTUS_GUI_RESOURCES,
+    )
+
+    lazy(["formal", "build/formal/"], lambda: define_formal(rule, dependencies))
+
+    rule("build/j63_nvc", mkdir, [])
+
+    rule("build/j63_nvc/meta-run", nop, [])
+    rule("build/j63_nvc/meta-elab", nop, [])
+    define_nvc_library(rule, vhdl_tree)
+    rule("regression", nop, [])
+    rule("bench-sim", nop, [])
+
+    gpu_cosim_meta = define_crate(
+        rule, dependencies, lazy, "gpu-cosim", "hw/gpu/gpu-cosim/", [GPU_COSIM_LIB]
+    )
+    define_simulation(
+        rule,
+        dependencies,
+        vhdl_tree,
+        closures,
+        name="tb_gpu",
+        tb_file="hw/gpu/tb_gpu.vhd",
+        run_args=["--load", GPU_COSIM_LIB],
+        run_deps=[gpu_cosim_meta],
+    )
+    define_simulation(
+        rule,
+        dependencies,
+        vhdl_tree,
+        closures,
+        name="tb_uart_rx",
+        tb_file="hw/serial/tb_uart_rx.vhd",
+        run_args=[],
+    )
+    define_simulation(
+        rule,
+        dependencies,
+        vhdl_tree,
+        closures,
+        name="tb_uart_tx",
+        tb_file="hw/serial/tb_uart_tx.vhd",
+        run_args=[],
+    )
+    define_simulation(
+        rule,
+        dependencies,
+        vhdl_tree,
+        closures,
+        name="tb_wb_debug",
+        tb_file="hw/debug/tb_wb_debug.vhd",
+        run_args=[],
+    )
+    wb_debug_cosim_meta = define_crate(
+        rule,
+        dependencies,
+        lazy,
+        "wb-debug-cosim",
+        "hw/debug/wb-debug-cosim/",
+        [WB_DEBUG_COSIM_LIB],
+    )
+    define_simulation(
+        rule,
+        dependencies,
+        vhdl_tree,
+        closures,
+        name="tb_wb_debug_cosim",
+        tb_file="hw/debug/tb_wb_debug_cosim.vhd",
+        run_args=["--load", WB_DEBUG_COSIM_LIB],
+        run_deps=[
+            wb_debug_cosim_meta,
+            "tools/sram_image.py",
+            "tools/uart_debug.py",
+            "tools/wb_debug_client.py",
+        ],
+        client="tools/wb_debug_cosim_test.py",
+    )
+
+    index, count = shard
+    regression_report = regression_report_file(shard)
+    regression_runs = sorted(dependencies["regression"])[index - 1 :: count]
+    rule(regression_report, write_regression_report, regression_runs)
+    dependencies["regression"] = [regression_report]
+    rule("bench-sim", write_sim_bench_report, dependencies["bench-sim"])
+
+    for source in PYTHON_SOURCES + QUARTUS_PROJECT_FILES + list(vhdl_tree):
+        rule(source, file_exists, [])
+
+    return Tasks(
+        dependencies=dependencies,
+        builders=builders,
+        resources=resources,
+        batches=batches,
+        outputs=outputs,
+        lazy=lazy_rules,
+    )
+
+
+def define_quartus(rule, quartus_sources):
+    # Each stage depends only on the qsf settings it reads, so a pin change
+    # re-runs the fitter onwards and an SDC change re-runs only timing analysis.
+    qsf_file = next(x for x in QUARTUS_PROJECT_FILES if x.endswith(".qsf"))
+    qpf_file = next(x for x in QUARTUS_PROJECT_FILES if x.endswith(".qpf"))
+    sdc_files = [x for x in QUARTUS_PROJECT_FILES if x.endswith(".sdc")]
+    ip_files = [x for x in QUARTUS_PROJECT_FILES if x.endswith(".qip")] + [
+        x for x in quartus_sources if x in GHDL_EXCLUDED
+    ]
+    verilog_file = f"{QUARTUS_INPUT_DIR}/j63_toplevel.v"
+    src_files = sdc_files + ip_files + [verilog_file]
+
+    rule(
+        f"{QUARTUS_INPUT_DIR}/meta-verilog",
+        lambda **kwargs: quartus_verilog(verilog_file=verilog_file, **kwargs),
+        [x for x in quartus_sources if x not in GHDL_EXCLUDED],
+    )
+    # The generated Verilog and settings are only rewritten when they change,
+    # and are fingerprinted by content so an unchanged netlist skips quartus_map.
+    rule(verilog_file, file_exists, [f"{QUARTUS_INPUT_DIR}/meta-verilog"])
+    rule(f"{QUARTUS_INPUT_DIR}/meta-settings", split_quartus_settings, [qsf_file])
+    for stage in QUARTUS_STAGES:
+        rule(
+            f"{QUARTUS_INPUT_DIR}/settings-{stage}",
+            file_exists,
+            [f"{QUARTUS_INPUT_DIR}/meta-settings"],
+        )
+
+    stage_deps = {
+        "map": [qpf_file, verilog_file] + ip_files,
+        "fit": [],
+        "asm": [],
+        "sta": sdc_files,
+    }
+    previous_stage = []
+    for stage in QUARTUS_STAGES:
+        define_quartus_stage(
+            rule,
+            stage,
+            qsf_file,
+            qpf_file,
+            src_files,
+            previous_stage
+            + [f"{QUARTUS_INPUT_DIR}/settings-{stage}"]
+            + stage_deps[stage],
+        )
+        previous_stage = [f"{QUARTUS_BUILD_DIR}/meta-{stage}"]
+
+    rule(
+        f"{QUARTUS_BUILD_DIR}/meta-built",
+        lambda task, **kwargs: touch(task),
+        previous_stage,
+        NO_RESOURCES,
+    )
+    define_quartus_sweep(rule, qsf_file)
+
+
+def define_quartus_sweep(rule, qsf_file):
+    # Each variant refits a private copy of the finished project, so variants
+    # can run side by side, outside the exclusive "quartus" resource.
+    results = []
+    for effort, effort_settings in QUARTUS_SWEEP_EFFORTS.items():
+        for seed in QUARTUS_SWEEP_SEEDS:
+            settings = {
+                **effort_settings,
+                "SEED": seed,
+                "NUM_PARALLEL_PROCESSORS": QUARTUS_SWEEP_RESOURCES.cpus,
+            }
+            variant_dir = f"{QUARTUS_SWEEP_DIR}/{effort}-seed{seed}"
+            define_quartus_sweep_run(rule, qsf_file, variant_dir, settings)
+            results.append(f"{variant_dir}/result.json")
+    # Promotion writes into the main project, so it waits for that to be built.
+    rule(
+        f"{QUARTUS_SWEEP_DIR}/results.json",
+        lambda **kwargs: write_quartus_sweep_report(qsf_file=qsf_file, **kwargs),
+        results + [f"{QUARTUS_BUILD_DIR}/meta-built"],
+    )
+    rule("quartus-sweep", nop, [f"{QUARTUS_SWEEP_DIR}/results.json"])
+
+
+def define_quartus_sweep_run(rule, qsf_file, variant_dir, settings):
+    rule(
+        f"{variant_dir}/result.json",
+        lambda **kwargs: quartus_sweep_run(
+            qsf_file=qsf_file, settings=settings, **kwargs
+        ),
+        [f"{QUARTUS_BUILD_DIR}/meta-built"],
+        QUARTUS_SWEEP_RESOURCES,
+        task_outputs=[f"{variant_dir}/project"],
+    )
+
+
+def define_quartus_stage(rule, stage, qsf_file, qpf_file, src_files, deps):
+    if stage in ("map", "fit"):
+        stage_resources = QUARTUS_RESOURCES
+    else:
+        stage_resources = QUARTUS_LIGHT_RESOURCES
+    rule(
+        f"{QUARTUS_BUILD_DIR}/meta-{stage}",
+        lambda **kwargs: quartus_stage(
+            stage=stage,
+            qsf_file=qsf_file,
+            qpf_file=qpf_file,
+            src_files=src_files,
+            **kwargs,
+        ),
+        deps,
+        stage_resources,
+        task_outputs=[QUARTUS_BUILD_DIR],
+    )
+
+
+def define_estimate(rule, vhdl_tree, closures, quartus_sources):
+    # Every entity is synthesized on its own from the sources it needs, so a
+    # change only re-estimates the modules that contain it.
+    results = []
+    for source in quartus_sources:
+        if source in GHDL_EXCLUDED:
+            continue
+        text = pathlib.Path(source).read_text(encoding="utf-8", errors="replace")
+        files = [
+            x
+            for x in transitive_closure(source, vhdl_tree, closures)
+            if x not in GHDL_EXCLUDED
+        ]
+        for entity in VHDL_ENTITY_RE.findall(VHDL_COMMENT_RE.sub("", text)):
+            results.append(define_estimate_module(rule, entity.lower(), files))
+    rule(f"{ESTIMATE_DIR}/results.json", write_estimate_report, results)
+    rule("estimate", nop, [f"{ESTIMATE_DIR}/results.json"])
+
+
+def define_estimate_module(rule, entity, files):
+    target = f"{ESTIMATE_DIR}/{entity}.json"
+    rule(
+        target,
+        lambda **kwargs: yosys_estimate(entity=entity, **kwargs),
+        files,
+        YOSYS_RESOURCES,
+        task_outputs=[f"{ESTIMATE_DIR}/{entity}"],
+    )
+    return target
+
+
+def define_lint(rule, name, builder, sources):
+    stamps = [f"build/lint/meta-{name}/{x}" for x in sources]
+    for stamp, source in zip(stamps, sources):
+        rule(stamp, builder, [source], batch=name)
+    rule(name, nop, stamps)
+
+
+def define_formal(rule, dependencies):
+    rule("formal", nop, ["build/formal/results.json"])
+    rule("build/formal/results.json", write_formal_report, [])
+    for sby_file in sorted(str(x) for x in pathlib.Path(VHDL_ROOT).rglob("*.sby")):
+        rule(sby_file, file_exists, [])
+        define_sby(rule, dependencies, sby_file)
+
+
+def define_sby(rule, dependencies, sby_file):
+    sby_path = pathlib.Path(sby_file)
+    name = pathlib.Path(sby_path).name.split(".")[0]
+    prefix = f"build/formal/{name}"
+    config_meta = f"build/formal/config/meta-{name}"
+
+    sby_contents = sby_path.read_text(encoding="utf-8").splitlines(keepends=False)
+    file_deps = sby_section(sby_contents, "files")
+    sby_tasks = [x.split()[0] for x in sby_section(sby_contents, "tasks")]
+    for source in file_deps:
+        rule(source, file_exists, [])
+
+    # Every [tasks] entry is its own task, keyed on the [files] it reads and
+    # the script, engines and options that apply to it.
+    rule(
+        config_meta,
+        lambda **kwargs: split_sby_config(name=name, sby_tasks=sby_tasks, **kwargs),
+        [sby_file],
+    )
+    targets = []
+    for sby_task in sby_tasks:
+        config = f"build/formal/config/{name}_{sby_task}"
+        rule(config, file_exists, [config_meta])
+        targets.append(
+            define_sby_task(rule, sby_file, prefix, sby_task, [config] + file_deps)
+        )
+    rule(f"build/formal/meta-run-{name}", nop, targets)
+    dependencies["build/formal/results.json"].extend(targets)
+
+
+def define_sby_task(rule, sby_file, prefix, sby_task, deps):
+    target = f"{prefix}_{sby_task}.json"
+    rule(
+        target,
+        lambda **kwargs: sby_run(
+            sby_file=sby_file, prefix=prefix, sby_task=sby_task, **kwargs
+        ),
+        deps,
+        SBY_RESOURCES,
+        task_outputs=[f"{prefix}_{sby_task}"],
+    )
+    return target
+
+
+def sby_section(sby_contents, name):
+    if f"[{name}]" not in sby_contents:
+        return []
+    section = []
+    for line in sby_contents[sby_contents.index(f"[{name}]") + 1 :]:
+        if line.startswith("["):
+            break
+        if line.strip():
+            section.append(line.strip())
+    return section
+
+
+def sby_task_lines(lines, sby_task, sby_tasks):
+    selected = []
+    for line in lines:
+        match = SBY_TASK_PREFIX_RE.match(line)
+        if match is None:
+            selected.append(line)
+            continue
+        names = match[1].split()
+        wanted = [x for x in names if not x.startswith("~")]
+        if f"~{sby_task}" in names:
+            continue
+        # Tags are not resolved, a line naming one is kept for every task
+        if wanted and sby_task not in wanted and set(wanted) <= set(sby_tasks):
+            continue
+        selected.append(match[2])
+    return selected
+
+
+def define_nvc_library(rule, vhdl_tree):
+    rule("build/j63_nvc/meta-quartus", nvc_quartus_install, [])
+    for source, deps in vhdl_tree.items():
+        analysis_deps = [source] + [nvc_analysis_stamp(x) for x in deps]
+        if source in GHDL_EXCLUDED:
+            analysis_deps.append("build/j63_nvc/meta-quartus")
+        rule(nvc_analysis_stamp(source), nvc_analyze, analysis_deps)
+
+
+def nvc_analysis_stamp(source):
+    return f"build/j63_nvc/meta-analyzed/{source.removesuffix('.vhd')}"
+
+
+def define_simulation(
+    rule,
+    dependencies,
+    vhdl_tree,
+    closures,
+    name,
+    tb_file,
+    run_args,
+    run_deps=(),
+    client=None,
+):
+    analysis_stamps = [
+        nvc_analysis_stamp(x) for x in transitive_closure(tb_file, vhdl_tree, closures)
+    ]
+    elab_deps = list(analysis_stamps)
+    elab_args = []
+    if name in SRAM_IMAGES:
+        image = define_sram_image(rule, name)
+        elab_deps.append(image)
+        elab_args.append(f"-gsram_image={image}")
+    rule(
+        f"build/j63_nvc/{name}/meta-elab",
+        lambda **kwargs: nvc_elaborate(toplevel=name, elab_args=elab_args, **kwargs),
+        elab_deps,
+    )
+    gtkw_file = tb_file.removesuffix(".vhd") + ".gtkw"
+    if os.path.exists(gtkw_file):
+        wave_include = f"build/j63_nvc/{name}/{name}.include"
+        rule(gtkw_file, file_exists, [])
+        rule(
+            f"build/j63_nvc/{name}/meta-include",
+            lambda **kwargs: write_wave_include(
+                gtkw_file=gtkw_file, include_file=wave_include, **kwargs
+            ),
+            [gtkw_file],
+        )
+        rule(wave_include, file_exists, [f"build/j63_nvc/{name}/meta-include"])
+        wave_deps = [wave_include]
+        gtkwave_args = [gtkw_file]
+    else:
+        wave_include = None
+        wave_deps = []
+        gtkwave_args = []
+    run_meta = f"build/j63_nvc/{name}/meta-run"
+    rule(
+        run_meta,
+        lambda **kwargs: nvc_run(
+            toplevel=name,
+            run_args=run_args,
+            wave_include=wave_include,
+            client=client,
+            **kwargs,
+        ),
+        [f"build/j63_nvc/{name}/meta-elab"]
+        + wave_deps
+        + list(run_deps)
+        + ([client] if client else []),
+        SIM_RESOURCES,
+    )
+    for generics in regression_matrix(name):
+        define_regression_run(
+            rule,
+            dependencies,
+            name,
+            generics,
+            elab_args,
+            elab_deps + list(run_deps),
+            run_args,
+        )
+    # A benchmark run has no client to drive the simulation and would wait for
+    # one forever
+    bench_modes = {} if client else SIM_BENCH_MODES
+    for mode, mode_args in bench_modes.items():
+        define_sim_bench(
+            rule,
+            dependencies,
+            name,
+            mode,
+            mode_args + elab_args,
+            elab_deps + list(run_deps),
+            run_args,
+        )
+    dependencies["build/j63_nvc/meta-run"].append(run_meta)
+    dependencies["build/j63_nvc/meta-elab"].append(f"build/j63_nvc/{name}/meta-elab")
+    rule(f"sim-{name}", nop, [run_meta])
+    rule(
+        f"waves-{name}",
+        lambda **kwargs: run(
+            ["gtkwave", f"build/j63_nvc/{name}/{name}.fst"] + gtkwave_args
+        ),
+        [],
+    )
+    return run_meta
+
+
+def define_sram_image(rule, name):
+    # Preloaded by sim_sram at elaboration, so tests start with the framebuffers
+    # and z-buffer already filled. The testbench takes its path as a generic.
+    image = f"build/j63_nvc/{name}/sram.bin"
+    assets = SRAM_IMAGES[name]
+    for asset in assets.values():
+        rule(asset, file_exists, [])
+    rule(
+        image,
+        lambda **kwargs: sram_image(assets=assets, **kwargs),
+        ["tools/sram_image.py"] + list(assets.values()),
+    )
+    return image
+
+
+def regression_matrix(name):
+    if name not in REGRESSION_TESTS:
+        return []
+    spec = REGRESSION_TESTS[name]
+    return [
+        generics if seed is None else {**generics, "seed": seed}
+        for generics in spec.get("generics", [{}])
+        for seed in spec.get("seeds", [None])
+    ]
+
+
+def define_regression_run(
+    rule, dependencies, name, generics, elab_args, deps, run_args
+):
+    # Each run elaborates in memory with its own generics, so runs of the same
+    # testbench share the analysed library but never an elaborated design.
+    variant = ",".join(f"{k}={v}" for k, v in generics.items()) or "default"
+    result = f"{REGRESSION_DIR}/{name}/{variant}/result.json"
+    timeout = REGRESSION_TESTS[name].get("timeout", REGRESSION_TIMEOUT)
+    rule(
+        result,
+        lambda **kwargs: nvc_regression_run(
+            toplevel=name,
+            variant=variant,
+            generics=generics,
+            elab_args=elab_args,
+            run_args=run_args,
+            timeout=timeout,
+            **kwargs,
+        ),
+        deps,
+        SIM_RESOURCES,
+    )
+    dependencies["regression"].append(result)
+
+
+def define_sim_bench(rule, dependencies, name, mode, elab_args, deps, run_args):
+    # Never written itself, so a benchmark always measures again. Runs share an
+    # exclusive resource to keep them from competing with each other.
+    bench = f"{SIM_BENCH_DIR}/{name}/{mode}"
+    timeout = REGRESSION_TESTS.get(name, {}).get("timeout", REGRESSION_TIMEOUT)
+    rule(
+        bench,
+        lambda **kwargs: nvc_bench_run(
+            toplevel=name,
+            mode=mode,
+            elab_args=elab_args,
+            run_args=run_args,
+            timeout=timeout,
+            **kwargs,
+        ),
+        deps,
+        SIM_BENCH_RESOURCES,
+    )
+    dependencies["bench-sim"].append(bench)
+
+
+def regression_report_file(shard):
+    index, count = shard
+    if count == 1:
+        return f"{REGRESSION_DIR}/results.json"
+    return f"{REGRESSION_DIR}/results-{index}-of-{count}.json"
+
+
+def define_crate(rule, dependencies, lazy, name, path, crate_outputs):
+    path = pathlib.Path(path)
+    meta_file = f"build/crates/meta-{name}"
+
+    def build_crate(**kwargs):
+        run(["cargo", "build", "--release"], cwd=path)
+        touch(meta_file)
+
+    def define_crate_rules():
+        sources = list((path / "src").rglob("*.rs")) + [
+            path / "Cargo.toml",
+            path / "Cargo.lock",
+        ]
+        for src in sources:
+            rule(src, file_exists, [])
+
+        rule(
+            meta_file, build_crate, sources, CARGO_RESOURCES, task_outputs=crate_outputs
+        )
+        rule(f"format-{name}", lambda **kwargs: run(["cargo", "fmt"], cwd=path), [])
+
+    lazy([meta_file, f"format-{name}"], define_crate_rules)
+    dependencies["format"].append(f"format-{name}")
+
+    return meta_file
+
+
+def filter_tasks(tasks, requested):
+    kept = {}
+    pending = list(requested)
+    while pending:
+        task = pending.pop()
+        if task in kept:
+            continue
+        if task not in tasks.dependencies and not expand_lazy_rules(tasks, task):
+            fatal(f"No rule to make {task}")
+        kept[task] = tasks.dependencies[task]
+        pending.extend(x for x in kept[task] if x not in kept)
+
+    return Tasks(
+        dependencies=kept,
+        builders=tasks.builders,
+        resources=tasks.resources,
+        batches=tasks.batches,
+        outputs=tasks.outputs,
+        lazy=tasks.lazy,
+    )
+
+
+def expand_lazy_rules(tasks, task):
+    task = str(task)
+    for entry in tasks.lazy:
+        names, definer = entry
+        if any(task == x or (x.endswith("/") and task.startswith(x)) for x in names):
+            tasks.lazy.remove(entry)
+            definer()
+            return task in tasks.dependencies
+    return False
+
+
+def task_up_to_date(task, fingerprint, db):
+    if fingerprint is None or db.stat(task) is None:
+        return False
+    return db.task_fingerprint(task) == fingerprint
+
+
+def task_fingerprint(task, tasks, db):
+    code, env = builder_digest(tasks.builders[task])
+    hasher = hashlib.sha256(code.encode())
+    for name in env:
+        hasher.update(f"{name}={os.environ.get(name, '')}\0".encode())
+    for dep in tasks.dependencies[task]:
+        if tasks.builders.get(dep, file_exists) is file_exists:
+            digest = db.file_digest(dep)
+        else:
+            digest = db.task_fingerprint(dep)
+        if digest is None:
+            return None
+        hasher.update(f"{dep}\0{digest}\0".encode())
+    return hasher.hexdigest()
+
+
+@functools.cache
+def builder_digest(builder):
+    hasher = hashlib.sha256()
+    env = set()
+    seen = set()
+
+    def visit_value(value):
+        if isinstance(value, types.FunctionType):
+            visit_function(value)
+        elif isinstance(value, types.CodeType):
+            visit_code(value, {})
+        elif isinstance(value, frozenset):
+            hasher.update(repr(sorted(value, key=repr)).encode())
+        else:
+            if value in FINGERPRINT_ENV:
+                env.add(value)
+            hasher.update(repr(value).encode())
+
+    def visit_function(func):
+        if func in seen:
+            return
+        seen.add(func)
+        visit_code(func.__code__, func.__globals__)
+        for cell in func.__closure__ or ():
+            visit_value(cell.cell_contents)
+
+    def visit_code(code, globals_):
+        hasher.update(code.co_code)
+        for const in code.co_consts:
+            visit_value(const)
+        for name in code.co_names:
+            if name not in globals_:
+                continue
+            value = globals_[name]
+            if isinstance(value, types.FunctionType):
+                visit_function(value)
+                continue
+            # Module-level settings the builder reads are part of its logic
+            text = stable_repr(value)
+            if text is not None:
+                hasher.update(f"{name}={text}\0".encode())
+
+    visit_function(builder)
+    return hasher.hexdigest(), sorted(env)
+
+
+# A repr that is the same in every run, or None for values without one, such
+# as modules, classes and objects that only show their address
+def stable_repr(value):
+    if isinstance(value, (str, bytes, int, float, type(None), re.Pattern)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        items = [stable_repr(x) for x in value]
+        if None in items:
+            return None
+        return f"{type(value).__name__}({', '.join(items)})"
+    if isinstance(value, (set, frozenset)):
+        items = [stable_repr(x) for x in value]
+        if None in items:
+            return None
+        return f"{{{', '.join(sorted(items))}}}"
+    if isinstance(value, dict):
+        items = [(stable_repr(k), stable_repr(v)) for k, v in value.items()]
+        if any(None in item for item in items):
+            return None
+        return f"{{{', '.join(f'{k}: {v}' for k, v in items)}}}"
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        fields = stable_repr(dataclasses.astuple(value))
+        return None if fields is None else type(value).__name__ + fields
+    return None
+
+
+class BuildDb:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.lock = threading.Lock()
+        self.saved = None
+        try:
+            self.saved = self.path.read_text()
+            contents = json.loads(self.saved)
+        except (FileNotFoundError, json.JSONDecodeError):
+            contents = {}
+        if contents.get("version") != BUILD_DB_VERSION:
+            contents = {}
+        self.files = contents.get("files", {})
+        self.tasks = contents.get("tasks", {})
+        self.vhdl_units = contents.get("vhdl_units", {})
+        self.durations = contents.get("durations", {})
+        self.digests = {}
+        self.stats = {}
+
+    def stat(self, path):
+        path = str(path)
+        with self.lock:
+            if path in self.stats:
+                return self.stats[path]
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            file_stat = None
+        with self.lock:
+            self.stats[path] = file_stat
+        return file_stat
+
+    def file_digest(self, path):
+        path = str(path)
+        with self.lock:
+            if path in self.digests:
+                return self.digests[path]
+        file_stat = self.stat(path)
+        if file_stat is None:
+            digest = None
+        elif stat.S_ISDIR(file_stat.st_mode):
+            digest = "dir"
+        else:
+            key = [file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino]
+            with self.lock:
+                cached = self.files.get(path)
+            if cached is not None and cached[:3] == key:
+                digest = cached[3]
+            else:
+                digest = hash_file(path)
+                with self.lock:
+                    self.files[path] = key + [digest]
+        with self.lock:
+            self.digests[path] = digest
+        return digest
+
+    def forget_file(self, path):
+        with self.lock:
+            self.digests.pop(str(path), None)
+            self.stats.pop(str(path), None)
+
+    def task_fingerprint(self, task):
+        with self.lock:
+            return self.tasks.get(str(task))
+
+    def record_task(self, task, fingerprint):
+        with self.lock:
+            if fingerprint is not None:
+                self.tasks[str(task)] = fingerprint
+
+    def task_duration(self, task, default):
+        with self.lock:
+            return self.durations.get(str(task), default)
+
+    def record_duration(self, task, duration):
+        with self.lock:
+            self.durations[str(task)] = duration
+
+    def forget_task(self, task):
+        with self.lock:
+            self.tasks.pop(str(task), None)
+
+    def close(self):
+        with self.lock:
+            contents = {
+                "version": BUILD_DB_VERSION,
+                "files": self.files,
+                "tasks": self.tasks,
+                "vhdl_units": self.vhdl_units,
+                "durations": self.durations,
+            }
+        text = json.dumps(contents, indent=1, sort_keys=True)
+        if text == self.saved:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(text)
+        os.replace(tmp_path, self.path)
+        self.saved = text
+
+
+def hash_file(path):
+    with open(path, "rb") as file_:
+        return hashlib.file_digest(file_, "sha256").hexdigest()
+
+
+def scan_vhdl(db):
+    sources = sorted(str(x) for x in pathlib.Path(VHDL_ROOT).rglob("*.vhd"))
+    units = {}
+    for source in sources:
+        digest = db.file_digest(source)
+        if digest not in db.vhdl_units:
+            text = pathlib.Path(source).read_text(encoding="utf-8", errors="replace")
+            db.vhdl_units[digest] = parse_vhdl_units(text)
+        units[source] = db.vhdl_units[digest]
+    db.vhdl_units = {db.file_digest(x): units[x] for x in sources}
+
+    providers = {}
+    for source, source_units in units.items():
+        for name in source_units["provides"]:
+            if name in providers:
+                fatal(f"{name} is defined in both {providers[name]} and {source}")
+            providers[name] = source
+
+    vhdl_tree = {}
+    for source, source_units in units.items():
+        deps = {providers[x] for x in source_units["uses"] if x in providers}
+        vhdl_tree[source] = sorted(deps - {source})
+    return vhdl_tree
+
+
+def parse_vhdl_units(text):
+    text = VHDL_COMMENT_RE.sub("", text)
+    uses = set()
+    for regex in [VHDL_USE_RE, VHDL_ENTITY_INST_RE, VHDL_COMPONENT_INST_RE]:
+        uses.update(x.lower() for x in regex.findall(text))
+    return {
+        "provides": sorted({x.lower() for x in VHDL_UNIT_RE.findall(text)}),
+        "uses": sorted(uses),
+    }
+
+
+def write_vhdl_ls(vhdl_tree):
+    config = {"libraries": {"j63": {"files": list(vhdl_tree)}}}
+    write_if_changed("vhdl_ls.toml", tomli_w.dumps(config))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("task", nargs="*")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="CPU slots available to the scheduler",
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        default=physical_memory() * 3 // 4,
+        help="memory budget in MiB",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="build/trace.json",
+        help="write a trace-event file loadable in Perfetto or chrome://tracing",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=ARTIFACT_CACHE_DIR,
+        help="artifact cache location, may be shared between users",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=ARTIFACT_CACHE_SIZE,
+        help="artifact cache size limit in GiB",
+    )
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--quartus-compile",
+        choices=QUARTUS_COMPILE_MODES,
+        help="Quartus compilation mode, defaults to $J63_QUARTUS_COMPILE or full",
+    )
+    parser.add_argument(
+        "--waves",
+        choices=WAVE_MODES,
+        help="waveform capture for sim-* targets: signals listed in the "
+        "testbench's .gtkw file (none without one), no waves, or every signal; "
+        "defaults to "
+        "$J63_WAVES or scoped",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=(1, 1),
+        metavar="K/N",
+        help="run only the K-th of N slices of the regression",
+    )
+    parser.add_argument(
+        "--benchmark",
+        nargs="?",
+        type=int,
+        const=20,
+        help="after building, time N no-op builds of the requested tasks",
+    )
+    parser.add_argument(
+        "--benchmark-graph",
+        action="store_true",
+        help="time the no-op path on synthetic trees of "
+        + ", ".join(str(x) for x in GRAPH_BENCHMARK_SIZES)
+        + " VHDL files",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="stay resident and rebuild affected tasks when sources change",
+    )
+    return parser.parse_args()
+
+
+def parse_shard(value):
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {value}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {value} out of range")
+    return index, count
+
+
+def physical_memory():
+    try:
+        pages = os.sysconf("SC_PHYS_PAGES")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return 16 * 1024
+    return pages * page_size // (1024 * 1024)
+
+
+def file_exists(dependencies, **kwargs):
+    for file_ in dependencies:
+        if not os.path.exists(file_):
+            fatal(f"No rule to make {file_}")
+
+
+def mkdir(task, **kwargs):
+    os.makedirs(task, exist_ok=True)
+
+
+def nop(**kwargs):
+    return
+
+
+def black_check(batch, **kwargs):
+    run(["black", "--check"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def ruff_check(batch, **kwargs):
+    run(["ruff", "check"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def vsg_check(batch, **kwargs):
+    run(["vsg", "-c", "vsg.yaml", "--"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def black_fix(batch, **kwargs):
+    run(["black"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def ruff_fix(batch, **kwargs):
+    run(["ruff", "check", "--fix"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def vsg_fix(batch, **kwargs):
+    run(["vsg", "-c", "vsg.yaml", "--fix"] + batch_sources(batch))
+    touch_batch(batch)
+
+
+def batch_sources(batch):
+    return [dep for _, dependencies in batch for dep in dependencies]
+
+
+def touch_batch(batch):
+    for task, _ in batch:
+        touch(task)
+
+
+def quartus_verilog(verilog_file, task, dependencies, **kwargs):
+    tmp_file = pathlib.Path(f"{verilog_file}.tmp")
+    mkdir(tmp_file.parent)
+    vhdl_to_verilog(
+        top_level="j63_toplevel",
+        output_file=str(tmp_file),
+        input_files=dependencies,
+        **kwargs,
+    )
+    write_if_changed(verilog_file, tmp_file.read_text())
+    tmp_file.unlink()
+    touch(task)
+
+
+def split_quartus_settings(task, dependencies, **kwargs):
+    settings = {x: [] for x in QUARTUS_STAGES}
+    for line in pathlib.Path(dependencies[0]).read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        stage = quartus_setting_stage(line)
+        if stage is not None:
+            settings[stage].append(line)
+    for stage, lines in settings.items():
+        write_if_changed(
+            f"{QUARTUS_INPUT_DIR}/settings-{stage}", "".join(f"{x}\n" for x in lines)
+        )
+    touch(task)
+
+
+def quartus_setting_stage(line):
+    for stage, pattern in QUARTUS_STAGE_SETTINGS:
+        if pattern.search(line):
+            return stage
+    return "map"
+
+
+def quartus_stage(stage, qsf_file, qpf_file, src_files, task, **kwargs):
+    build_dir = pathlib.Path(task).parent
+    write_quartus_project(build_dir, qsf_file, qpf_file, src_files)
+
+    quartus = os.environ["QUARTUS_ROOTDIR"]
+    project = pathlib.Path(qsf_file).stem
+    if stage == "map":
+        run([f"{quartus}/bin/quartus_sh", "--prepare", project], cwd=build_dir)
+    run(quartus_command(stage, project), cwd=build_dir)
+    touch(task)
+
+
+def quartus_command(stage, project):
+    if stage == "sta":
+        settings_args = []
+    else:
+        settings_args = ["--read_settings_files=on", "--write_settings_files=off"]
+    return (
+        [f"{os.environ['QUARTUS_ROOTDIR']}/bin/quartus_{stage}"]
+        + settings_args
+        + [project, "-c", project]
+    )
+
+
+def quartus_sweep_run(qsf_file, settings, task, **kwargs):
+    # A plain copy, not clone_file: hardlinks would let the fitter write into
+    # the main project's database. copyfile also leaves out the read-only modes
+    # of outputs restored from the artifact cache.
+    variant_dir = pathlib.Path(task).parent
+    build_dir = variant_dir / "project"
+    project = pathlib.Path(qsf_file).stem
+    remove_path(build_dir)
+    shutil.copytree(QUARTUS_BUILD_DIR, build_dir, copy_function=shutil.copyfile)
+
+    qsf_path = build_dir / f"{project}.qsf"
+    overridden = re.compile(rf"-name ({'|'.join(settings)})\b")
+    lines = [x for x in qsf_path.read_text().splitlines() if not overridden.search(x)]
+    lines += [f"set_global_assignment -name {k} {v}" for k, v in settings.items()]
+    qsf_path.write_text("".join(f"{x}\n" for x in lines))
+
+    start = time.monotonic()
+    for stage in ["fit", "asm", "sta"]:
+        returncode, _ = run_logged(
+            quartus_command(stage, project),
+            variant_dir / f"{stage}.log",
+            QUARTUS_SWEEP_TIMEOUT,
+            cwd=build_dir,
+        )
+        if returncode != 0:
+            break
+    result = {
+        "variant": variant_dir.name,
+        "settings": settings,
+        "status": "failed" if returncode != 0 else "passed",
+        "returncode": returncode,
+        "wall_time": round(time.monotonic() - start, 3),
+        "clocks": {},
+        "log": str(variant_dir / f"{stage}.log"),
+    }
+    if returncode == 0:
+        result["clocks"] = quartus_timing(build_dir / f"{project}.sta.rpt")
+    pathlib.Path(task).write_text(json.dumps(result, indent=2))
+
+
+def quartus_timing(report_file):
+    # Worst slack and Fmax per clock over all timing corners
+    clocks = {}
+    for title, rows in quartus_report_tables(report_file).items():
+        if title.endswith(" Model Setup Summary"):
+            kind, clock_key, value_key = "setup", "Clock", "Slack"
+        elif title.endswith(" Model Hold Summary"):
+            kind, clock_key, value_key = "hold", "Clock", "Slack"
+        elif title.endswith(" Model Fmax Summary"):
+            kind, clock_key, value_key = "fmax", "Clock Name", "Restricted Fmax"
+        else:
+            continue
+        for row in rows:
+            value = float(row[value_key].split()[0])
+            entry = clocks.setdefault(row[clock_key], {})
+            entry[kind] = min(entry.get(kind, value), value)
+    return clocks
+
+
+def quartus_report_tables(report_file):
+    # Report panels are blocks of ;-delimited rows: a title, a header, then data
+    tables = {}
+    for block in pathlib.Path(report_file).read_text(errors="replace").split("\n\n"):
+        rows = [
+            [x.strip() for x in line.strip()[1:-1].split(";")]
+            for line in block.splitlines()
+            if line.startswith(";")
+        ]
+        if len(rows) >= 2:
+            tables[rows[0][0]] = [dict(zip(rows[1], x)) for x in rows[2:]]
+    return tables
+
+
+def worst_slack(result):
+    clocks = result["clocks"].values()
+    return (
+        min((x.get("setup", float("inf")) for x in clocks), default=float("-inf")),
+        min((x.get("hold", float("inf")) for x in clocks), default=float("-inf")),
+    )
+
+
+def write_quartus_sweep_report(qsf_file, task, dependencies, **kwargs):
+    project = pathlib.Path(qsf_file).stem
+    baseline = {
+        "variant": "baseline",
+        "status": "passed",
+        "clocks": quartus_timing(f"{QUARTUS_BUILD_DIR}/{project}.sta.rpt"),
+    }
+    results = [
+        json.loads(pathlib.Path(x).read_text())
+        for x in dependencies
+        if x.endswith(".json")
+    ]
+    passed = [x for x in results if x["status"] == "passed"]
+    best = max(passed, key=worst_slack, default=None)
+
+    # Only replace the bitstream the main build produced if a variant beats it
+    promoted = None
+    if best is not None and worst_slack(best) > worst_slack(baseline):
+        promoted = best["variant"]
+        sof_file = pathlib.Path(f"{QUARTUS_BUILD_DIR}/{project}.sof")
+        tmp_file = sof_file.with_suffix(".sof.tmp")
+        shutil.copyfile(
+            f"{QUARTUS_SWEEP_DIR}/{promoted}/project/{sof_file.name}", tmp_file
+        )
+        os.replace(tmp_file, sof_file)
+    pathlib.Path(task).write_text(
+        json.dumps(
+            {"baseline": baseline, "promoted": promoted, "results": results}, indent=2
+        )
+    )
+
+    rows = [baseline] + results
+    clock_width = max((len(y) for x in rows for y in x["clocks"]), default=5)
+    variant_width = max(len(x["variant"]) for x in rows)
+    logging.info(
+        f"{'Variant':<{variant_width}}  {'Clock':<{clock_width}}  "
+        f"{'Setup':>7} {'Hold':>7} {'Fmax':>11}"
+    )
+    for row in rows:
+        if row["status"] != "passed":
+            logging.info(f"{row['variant']:<{variant_width}}  {row['status']}")
+            continue
+        for clock, timing in sorted(row["clocks"].items()):
+            setup = timing.get("setup")
+            hold = timing.get("hold")
+            fmax = timing.get("fmax")
+            logging.info(
+                f"{row['variant']:<{variant_width}}  {clock:<{clock_width}}  "
+                + ("-" if setup is None else f"{setup:.3f}").rjust(7)
+                + " "
+                + ("-" if hold is None else f"{hold:.3f}").rjust(7)
+                + " "
+                + ("-" if fmax is None else f"{fmax:.2f} MHz").rjust(11)
+            )
+    for result in results:
+        if result["status"] != "passed":
+            logging.error(f"{result['variant']}: failed, see {result['log']}")
+    if promoted is None:
+        logging.info(f"Kept the baseline {project}.sof, no variant had more slack")
+    else:
+        logging.info(f"Promoted {promoted} to {QUARTUS_BUILD_DIR}/{project}.sof")
+
+
+def write_quartus_project(build_dir, qsf_file, qpf_file, src_files):
+    # Stages restored from the artifact cache may carry another build's project
+    # files, so every stage writes them before running.
+    mkdir(build_dir)
+    # Quartus uses as many cores as the scheduler reserved for map and fit
+    qsf_contents = "".join(
+        f"{x}\n"
+        for x in pathlib.Path(qsf_file).read_text().splitlines()
+        if not QUARTUS_PARALLEL_RE.search(x)
+    )
+    qsf_contents += (
+        "set_global_assignment -name NUM_PARALLEL_PROCESSORS "
+        f"{QUARTUS_RESOURCES.cpus}\n"
+    )
+    for src_file in map(pathlib.Path, src_files):
+        if src_file.suffix == ".vhd":
+            type_ = "VHDL_FILE"
+        elif src_file.suffix == ".v":
+            type_ = "VERILOG_FILE"
+        elif src_file.suffix == ".sdc":
+            type_ = "SDC_FILE"
+        elif src_file.suffix == ".qip":
+            type_ = "QIP_FILE"
+        else:
+            fatal(f"Unknown src file type {src_file}")
+        qsf_contents += f"set_global_assignment -name {type_} {src_file.absolute()}\n"
+
+    compile_mode = os.environ.get("J63_QUARTUS_COMPILE", "full")
+    if compile_mode == "smart":
+        qsf_contents += "set_global_assignment -name SMART_RECOMPILE ON\n"
+    elif compile_mode == "incremental":
+        qsf_contents = qsf_contents.replace(
+            "PARTITION_NETLIST_TYPE SOURCE", "PARTITION_NETLIST_TYPE POST_FIT"
+        )
+    elif compile_mode != "full":
+        fatal(f"Unknown Quartus compile mode {compile_mode}")
+
+    write_if_changed(build_dir / pathlib.Path(qsf_file).name, qsf_contents)
+    write_if_changed(
+        build_dir / pathlib.Path(qpf_file).name, pathlib.Path(qpf_file).read_text()
+    )
+
+
+def open_quartus_project(**kwargs):
+    # The GUI saves into the project, which may be hardlinked into the cache
+    unshare_outputs(["build/j63_quartus"])
+    run(
+        [f"{os.environ["QUARTUS_ROOTDIR"]}/bin/quartus", "j63"],
+        cwd="build/j63_quartus",
+    )
+
+
+def vhdl_to_verilog(top_level, output_file, input_files, **kwargs):
+    oss_cad_run(
+        [
+            "yosys",
+            "-m",
+            "ghdl",
+            "-p",
+            f"ghdl --std=08 {' '.join(input_files)} -e {top_level}; check; opt; write_verilog {output_file}",
+        ]
+    )
+
+
+def yosys_estimate(entity, task, dependencies, **kwargs):
+    work_dir = pathlib.Path(task).with_suffix("")
+    mkdir(work_dir)
+    log_file = work_dir / "yosys.log"
+    stat_file = work_dir / "stat.json"
+    depth_file = work_dir / "depth.txt"
+    returncode = oss_cad_run(
+        [
+            "yosys",
+            "-q",
+            "-l",
+            str(log_file),
+            "-m",
+            "ghdl",
+            "-p",
+            f"ghdl --std=08 {' '.join(dependencies)} -e {entity}; "
+            f"synth_intel -family {ESTIMATE_FAMILY} -top {entity}; "
+            f"tee -q -o {stat_file} stat -json; "
+            f"tee -q -o {depth_file} ltp -noff",
+        ],
+        check=False,
+    )
+    result = {
+        "module": entity,
+        "status": "failed" if returncode != 0 else "passed",
+        "log": str(log_file),
+    }
+    if returncode == 0:
+        stat_text = stat_file.read_text()
+        cells = json.loads(stat_text[stat_text.index("{") :])["design"][
+            "num_cells_by_type"
+        ]
+        for name, pattern in ESTIMATE_CELLS.items():
+            result[name] = sum(n for x, n in cells.items() if pattern.search(x))
+        depth = YOSYS_LTP_RE.search(depth_file.read_text())
+        result["depth"] = None if depth is None else int(depth.group(1))
+    pathlib.Path(task).write_text(json.dumps(result, indent=2))
+
+
+def write_estimate_report(task, dependencies, **kwargs):
+    # The previous report is whatever the last change produced, so the deltas
+    # show what this change did to each module.
+    results = [json.loads(pathlib.Path(x).read_text()) for x in dependencies]
+    try:
+        previous = {x["module"]: x for x in json.loads(pathlib.Path(task).read_text())}
+    except FileNotFoundError:
+        previous = {}
+    pathlib.Path(task).write_text(json.dumps(results, indent=2))
+
+    columns = list(ESTIMATE_CELLS) + ["depth"]
+    width = max((len(x["module"]) for x in results), default=6)
+    logging.info(
+        f"{'Module':<{width}}  " + " ".join(f"{x.upper():>12}" for x in columns)
+    )
+    grown = []
+    for result in results:
+        if result["status"] != "passed":
+            logging.info(f"{result['module']:<{width}}  {result['status']}")
+            continue
+        old = previous.get(result["module"], {})
+        cells = []
+        for column in columns:
+            value = result[column]
+            old_value = old.get(column)
+            if value is None:
+                cells.append("-")
+            elif old_value is None or old_value == value:
+                cells.append(str(value))
+            else:
+                cells.append(f"{value} ({value - old_value:+})")
+                if value > old_value * (1 + ESTIMATE_GROWTH):
+                    grown.append(f"{result['module']} {column} {old_value} -> {value}")
+        logging.info(
+            f"{result['module']:<{width}}  " + " ".join(f"{x:>12}" for x in cells)
+        )
+
+    for entry in grown:
+        logging.warning(f"Grew by more than {ESTIMATE_GROWTH:.0%}: {entry}")
+    failed = [x for x in results if x["status"] != "passed"]
+    for result in failed:
+        logging.error(f"{result['module']}: see {result['log']}")
+    if failed:
+        fatal(f"{len(failed)} modules failed to synthesize")
+
+
+def split_sby_config(name, sby_tasks, task, dependencies, **kwargs):
+    sby_contents = pathlib.Path(dependencies[0]).read_text().splitlines()
+    for sby_task in sby_tasks:
+        config = []
+        for section in ("options", "engines", "script"):
+            config.append(f"[{section}]")
+            config.extend(
+                sby_task_lines(sby_section(sby_contents, section), sby_task, sby_tasks)
+            )
+        write_if_changed(
+            f"build/formal/config/{name}_{sby_task}", "".join(f"{x}\n" for x in config)
+        )
+    touch(task)
+
+
+def sby_run(sby_file, prefix, sby_task, task, **kwargs):
+    start = time.monotonic()
+    returncode = oss_cad_run(
+        [
+            "sby",
+            "--yosys",
+            "yosys -m ghdl",
+            "-f",
+            "--prefix",
+            prefix,
+            sby_file,
+            sby_task,
+        ],
+        check=False,
+    )
+    wall_time = time.monotonic() - start
+
+    log_file = pathlib.Path(f"{prefix}_{sby_task}/logfile.txt")
+    # Proof results are cached like any output, sby errors are not
+    if returncode not in SBY_STATUS:
+        fatal(f"sby {sby_task} failed, see {log_file}", returncode)
+    try:
+        log = log_file.read_text(errors="replace")
+    except FileNotFoundError:
+        log = ""
+    steps = [int(x) for x in SBY_STEP_RE.findall(log)]
+    solver_time = SBY_TIME_RE.findall(log)
+    result = {
+        "name": pathlib.Path(prefix).name,
+        "task": sby_task,
+        "status": SBY_STATUS[returncode],
+        "depth": max(steps) + 1 if steps else None,
+        "time": float(solver_time[-1]) if solver_time else round(wall_time, 3),
+        "log": str(log_file),
+    }
+    pathlib.Path(task).write_text(json.dumps(result, indent=2))
+
+
+def write_formal_report(task, dependencies, **kwargs):
+    results = [json.loads(pathlib.Path(x).read_text()) for x in dependencies]
+    pathlib.Path(task).write_text(json.dumps(results, indent=2))
+
+    width = max((len(f"{x['name']} {x['task']}") for x in results), default=0)
+    logging.info(f"{'Proof':<{width}}  {'Status':<8} {'Depth':>5} {'Time':>8}")
+    for result in results:
+        depth = "-" if result["depth"] is None else result["depth"]
+        logging.info(
+            f"{result['name'] + ' ' + result['task']:<{width}}  "
+            f"{result['status']:<8} {depth:>5} {result['time']:>7.1f}s"
+        )
+    failed = [x for x in results if x["status"] != "PASS"]
+    for result in failed:
+        logging.error(f"{result['name']} {result['task']}: see {result['log']}")
+    if failed:
+        fatal(f"{len(failed)} formal proofs did not pass")
+
+
+def nvc_quartus_install(task, **kwargs):
+    build_dir = pathlib.Path(task).parent
+
+    env = os.environ.copy()
+    env["NVC_INSTALL_DEST"] = str(build_dir.absolute())
+    build_dir.mkdir(exist_ok=True, parents=True)
+    run(["nvc", "--install", "quartus"], cwd=build_dir, env=env)
+
+    touch(task)
+
+
+def nvc_analyze(task, dependencies, **kwargs):
+    mkdir(NVC_LIBRARY_DIR)
+    run(nvc_command() + ["-a"] + [x for x in dependencies if x.endswith(".vhd")])
+    touch(task)
+
+
+def nvc_elaborate(toplevel, elab_args, task, **kwargs):
+    run(nvc_command() + ["-e"] + elab_args + [toplevel])
+    touch(task)
+
+
+def nvc_run(toplevel, wave_include, task, client=None, **kwargs):
+    build_dir = pathlib.Path(task).parent
+    run_args = kwargs.get("run_args", [])
+    wave_file = build_dir / f"{toplevel}.fst"
+    wave_mode = os.environ.get("J63_WAVES", "scoped")
+    if wave_mode == "scoped" and wave_include is None:
+        # Without a .gtkw there is no scope, and dumping everything instead can
+        # take longer than the simulation
+        logging.warning(f"No .gtkw file for {toplevel}, running without waves")
+        wave_mode = "none"
+    if wave_mode == "none":
+        # Don't leave a dump from an earlier run around for waves-* to show.
+        wave_file.unlink(missing_ok=True)
+        wave_args = []
+    elif wave_mode in ("scoped", "full"):
+        wave_args = [f"--wave={wave_file}", f"--gtkw={build_dir}/{toplevel}.gtkw"]
+        if wave_mode == "scoped":
+            wave_args += [
+                f"--include={x}"
+                for x in pathlib.Path(wave_include).read_text().splitlines()
+            ]
+    else:
+        fatal(f"Unknown wave mode {wave_mode}")
+    cmd = (
+        nvc_command()
+        + ["-r"]
+        + run_args
+        + ["--ieee-warnings=off"]
+        + wave_args
+        + [toplevel]
+    )
+    if client is None:
+        run(cmd)
+    else:
+        run_with_client(cmd, client, build_dir / f"{toplevel}.sock")
+    touch(task)
+
+
+def run_with_client(cmd, client, socket_path):
+    # The simulation listens on socket_path for the client, which connects once
+    # it appears and drives the simulation until it disconnects
+    import signal
+
+    socket_path.unlink(missing_ok=True)
+    env = {**os.environ, WB_DEBUG_SOCKET_ENV: str(socket_path)}
+    logging.info(" ".join(cmd))
+    start = time.monotonic()
+    simulation = subprocess.Popen(cmd, env=env)
+    client_code = run([sys.executable, client, str(socket_path)], check=False)
+    if client_code != 0:
+        # Otherwise a simulation the client never connected to waits forever.
+        # Popen.kill would reap it before wait4 gets the resource usage.
+        os.kill(simulation.pid, signal.SIGKILL)
+    _, status, usage = os.wait4(simulation.pid, 0)
+    TRACE.command(cmd, start, usage)
+    code = os.waitstatus_to_exitcode(status)
+    if client_code != 0:
+        fatal(f"Client failed: {client}", client_code)
+    if code != 0:
+        fatal("Command failed: " + " ".join(cmd), code)
+
+
+def write_wave_include(gtkw_file, include_file, task, **kwargs):
+    # Each trace line of a .gtkw save file is a dotted hierarchical name,
+    # optionally with a bit range; nvc wants :-separated paths of whole signals.
+    # Comments, settings, flags, blank separators and concatenated vectors
+    # are skipped.
+    signals = {}
+    for line in pathlib.Path(gtkw_file).read_text().splitlines():
+        line = line.strip()
+        if not line or line[0] in "[*@-#":
+            continue
+        signal = GTKW_RANGE_RE.sub("", line)
+        signals[":" + signal.replace(".", ":").lower()] = None
+    write_if_changed(include_file, "".join(f"{x}\n" for x in signals))
+    touch(task)
+
+
+def sram_image(assets, task, **kwargs):
+    mkdir(pathlib.Path(task).parent)
+    run(
+        [sys.executable, "tools/sram_image.py", task]
+        + [f"--{k}={v}" for k, v in assets.items()]
+    )
+
+
+def nvc_regression_run(
+    toplevel, variant, generics, elab_args, run_args, timeout, task, **kwargs
+):
+    log_file = pathlib.Path(task).parent / f"{toplevel}.log"
+    returncode, wall_time = run_logged(
+        nvc_command()
+        + ["-e", "--jit", "--no-save"]
+        + elab_args
+        + [f"-g{k}={v}" for k, v in generics.items()]
+        + [toplevel, "-r"]
+        + run_args
+        + ["--ieee-warnings=off"],
+        log_file,
+        timeout,
+    )
+    if wall_time >= timeout:
+        status = "timeout"
+    elif returncode != 0:
+        status = "failed"
+    else:
+        status = "passed"
+    result = {
+        "name": toplevel,
+        "variant": variant,
+        "generics": generics,
+        "status": status,
+        "returncode": returncode,
+        "wall_time": round(wall_time, 3),
+        "sim_time_ns": simulated_time(log_file),
+        "log": str(log_file),
+    }
+    pathlib.Path(task).write_text(json.dumps(result, indent=2))
+
+
+def nvc_bench_run(toplevel, mode, elab_args, run_args, timeout, task, **kwargs):
+    log_file = pathlib.Path(f"{task}.log")
+    returncode, wall_time = run_logged(
+        nvc_command()
+        + ["-e", "--no-save"]
+        + elab_args
+        + [toplevel, "-r"]
+        + run_args
+        + ["--ieee-warnings=off"],
+        log_file,
+        timeout,
+    )
+    if wall_time >= timeout:
+        status = "timeout"
+    elif returncode != 0:
+        status = "failed"
+    else:
+        status = "passed"
+    sim_time_ns = simulated_time(log_file)
+    result = {
+        "name": toplevel,
+        "mode": mode,
+        "status": status,
+        "wall_time": round(wall_time, 3),
+        "sim_time_ns": sim_time_ns,
+        "cycles_per_second": None,
+        "log": str(log_file),
+    }
+    if status == "passed" and sim_time_ns:
+        result["cycles_per_second"] = round(
+            sim_time_ns / SIM_BENCH_CLOCK_PERIOD_NS / wall_time
+        )
+    pathlib.Path(f"{task}.json").write_text(json.dumps(result, indent=2))
+
+
+def write_sim_bench_report(dependencies, **kwargs):
+    results = {
+        f"{x['name']} {x['mode']}": x
+        for x in (
+            json.loads(pathlib.Path(f"{x}.json").read_text()) for x in dependencies
+        )
+    }
+    commit = git_commit()
+    history_file = pathlib.Path(SIM_BENCH_HISTORY)
+    try:
+        history = json.loads(history_file.read_text())
+    except FileNotFoundError:
+        history = {}
+    previous_commit = next((x for x in reversed(history) if x != commit), None)
+    previous = {} if previous_commit is None else history[previous_commit]["results"]
+    # Re-running at the same commit replaces its entry and moves it last
+    history.pop(commit, None)
+    history[commit] = {"time": time.time(), "results": results}
+    mkdir(history_file.parent)
+    history_file.write_text(json.dumps(history, indent=1))
+
+    names = sorted({x["name"] for x in results.values()})
+    width = max((len(x) for x in names), default=9)
+    logging.info(
+        f"{'Testbench':<{width}}  {'Sim time':>10}  "
+        + "  ".join(f"{x:>18}" for x in SIM_BENCH_MODES)
+        + "  (cycles/s"
+        + ("" if previous_commit is None else f", change since {previous_commit}")
+        + ")"
+    )
+    regressed = []
+    failed = []
+    for name in names:
+        cells = []
+        sim_time_ns = None
+        for mode in SIM_BENCH_MODES:
+            key = f"{name} {mode}"
+            result = results[key]
+            if result["status"] != "passed":
+                failed.append(result)
+                cells.append(result["status"])
+                continue
+            sim_time_ns = result["sim_time_ns"]
+            rate = result["cycles_per_second"]
+            old_rate = previous.get(key, {}).get("cycles_per_second")
+            if rate is None:
+                cells.append("-")
+            elif old_rate is None:
+                cells.append(f"{rate / 1e3:.1f}k")
+            else:
+                change = rate / old_rate - 1
+                cells.append(f"{rate / 1e3:.1f}k ({change:+.0%})")
+                if change < -SIM_BENCH_THRESHOLD:
+                    regressed.append(f"{key} {old_rate} -> {rate} cycles/s")
+        sim_time = "-" if sim_time_ns is None else f"{sim_time_ns / 1e6:.3f} ms"
+        logging.info(
+            f"{name:<{width}}  {sim_time:>10}  " + "  ".join(f"{x:>18}" for x in cells)
+        )
+    logging.info(f"History for {commit} in {history_file}")
+
+    for result in failed:
+        logging.error(f"{result['name']} {result['mode']}: see {result['log']}")
+    for entry in regressed:
+        logging.error(f"Throughput dropped over {SIM_BENCH_THRESHOLD:.0%}: {entry}")
+    if failed or regressed:
+        fatal(f"{len(failed)} benchmarks failed, {len(regressed)} regressed")
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def simulated_time(log_file):
+    matches = NVC_TIME_RE.findall(log_file.read_text(errors="replace"))
+    if not matches:
+        return None
+    value, unit = matches[-1]
+    return int(value) * NVC_TIME_UNITS[unit]
+
+
+def write_regression_report(task, dependencies, **kwargs):
+    results = [json.loads(pathlib.Path(x).read_text()) for x in dependencies]
+    failed = [x for x in results if x["status"] != "passed"]
+    summary = {
+        "tests": len(results),
+        "passed": len(results) - len(failed),
+        "failed": len(failed),
+        "wall_time": round(sum(x["wall_time"] for x in results), 3),
+        "results": results,
+    }
+    pathlib.Path(task).write_text(json.dumps(summary, indent=2))
+    write_junit(pathlib.Path(task).with_suffix(".xml"), results)
+
+    for result in failed:
+        logging.error(
+            f"{result['name']} {result['variant']}: {result['status']}, "
+            f"see {result['log']}"
+        )
+    logging.info(
+        f"Regression: {summary['passed']} passed, {summary['failed']} failed, "
+        f"results in {task}"
+    )
+    if failed:
+        fatal(f"{len(failed)} regression tests failed")
+
+
+def write_junit(path, results):
+    import xml.etree.ElementTree
+
+    element = xml.etree.ElementTree.Element
+    sub_element = xml.etree.ElementTree.SubElement
+    suites = element("testsuites")
+    for name in dict.fromkeys(x["name"] for x in results):
+        suite_results = [x for x in results if x["name"] == name]
+        suite = sub_element(
+            suites,
+            "testsuite",
+            name=name,
+            tests=str(len(suite_results)),
+            failures=str(sum(x["status"] != "passed" for x in suite_results)),
+            time=f"{sum(x['wall_time'] for x in suite_results):.3f}",
+        )
+        for result in suite_results:
+            case = sub_element(
+                suite,
+                "testcase",
+                classname=name,
+                name=result["variant"],
+                time=str(result["wall_time"]),
+            )
+            properties = sub_element(case, "properties")
+            sub_element(
+                properties,
+                "property",
+                name="sim_time_ns",
+                value=str(result["sim_time_ns"]),
+            )
+            if result["status"] != "passed":
+                failure = sub_element(case, "failure", message=result["status"])
+                log_lines = pathlib.Path(result["log"]).read_text(errors="replace")
+                failure.text = "\n".join(log_lines.splitlines()[-50:])
+    xml.etree.ElementTree.indent(suites)
+    xml.etree.ElementTree.ElementTree(suites).write(
+        path, encoding="utf-8", xml_declaration=True
+    )
+
+
+def nvc_command():
+    return [
+        "nvc",
+        f"--work=j63:{NVC_LIBRARY_DIR}/j63",
+        "-L",
+        NVC_LIBRARY_DIR,
+        "--std=2008",
+    ]
+
+
+def write_if_changed(path, contents):
+    path = pathlib.Path(path)
+    try:
+        if path.read_text() == contents:
+            return
+    except FileNotFoundError:
+        mkdir(path.parent)
+    path.write_text(contents)
+
+
+def touch(path):
+    mkdir(pathlib.Path(path).parent)
+    pathlib.Path(path).write_text("")
+
+
+def oss_cad_run(cmd, cwd=None, check=True):
+    cad_root = os.environ["OSS_CAD_ROOTDIR"]
+
+    env = os.environ.copy()
+    env["PATH"] = f"{cad_root}/bin:{cad_root}/py3bin:{env['PATH']}"
+    env["GHDL_PREFIX"] = f"{cad_root}/lib/ghdl"
+    env["VERILATOR_ROOT"] = f"{cad_root}/share/verilator"
+    env["VIRTUAL_ENV"] = cad_root
+
+    return run(cmd, cwd=cwd, env=env, check=check)
+
+
+def run(cmd, cwd=None, env=None, check=True):
+    logging.info(" ".join(cmd))
+    start = time.monotonic()
+    process = subprocess.Popen(cmd, cwd=cwd, env=env)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    TRACE.command(cmd, start, usage)
+    if check and process.returncode != 0:
+        fatal("Command failed: " + " ".join(cmd), process.returncode)
+    return process.returncode
+
+
+def run_logged(cmd, log_file, timeout, cwd=None):
+    logging.info(" ".join(cmd))
+    mkdir(pathlib.Path(log_file).parent)
+    start = time.monotonic()
+    with open(log_file, "wb") as log:
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    _, status, usage = os.wait4(process.pid, 0)
+    timer.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    TRACE.command(cmd, start, usage)
+    return process.returncode, time.monotonic() - start
+
+
+def fatal(message, code=1):
+    logging.error(message)
+    sys.exit(code)
+
+
+def transitive_closure(root, nodes, memo=None):
+    # Iterative post-order walk, so each node's closure lists dependencies
+    # before dependents. Closures are kept per node in memo, which callers can
+    # share to avoid re-expanding common subtrees.
+    if memo is None:
+        memo = {}
+    active = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if node in memo:
+            continue
+        if expanded:
+            closure = {}
+            for dep in nodes[node]:
+                closure.update(dict.fromkeys(memo.get(dep, (dep,))))
+            closure[node] = None
+            memo[node] = tuple(closure)
+            active.discard(node)
+        elif node not in active:
+            active.add(node)
+            stack.append((node, True))
+            stack.extend((x, False) for x in nodes[node] if x not in memo)
+    return list(memo[root])
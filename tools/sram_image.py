@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import pathlib
+
+import PIL
+from PIL import Image, ImageChops, ImageOps
+
+# SRAM layout, see gpu_pkg.vhd
+FB_WIDTH = 320
+FB_HEIGHT = 240
+FB_FRAME = FB_WIDTH * FB_HEIGHT
+FB_FRAME_ADDR_0 = 0
+FB_FRAME_ADDR_1 = FB_FRAME_ADDR_0 + FB_FRAME
+FB_ZBUF_ADDR = FB_FRAME_ADDR_1 + FB_FRAME
+ZBUF_FAR = 0xFFFF
+
+FIT_MODES = ["crop", "pad", "stretch"]
+BAYER_4X4 = [0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5]
+FRAMEBUFFER_CACHE = os.environ.get(
+    "J63_FRAMEBUFFER_CACHE", os.path.expanduser("~/.cache/j63-framebuffers")
+)
+FRAMEBUFFER_CACHE_VERSION = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack images into a raw SRAM image of big-endian 16-bit "
+        "words: frame 0, frame 1, then the z-buffer"
+    )
+    parser.add_argument("output")
+    parser.add_argument("--frame0", help="image for frame 0, black if omitted")
+    parser.add_argument("--frame1", help="image for frame 1, black if omitted")
+    parser.add_argument(
+        "--zbuf",
+        help="grayscale image for the z-buffer, 8 or 16 bits per pixel, "
+        "cleared to the far plane if omitted",
+    )
+    add_conversion_arguments(parser)
+    args = parser.parse_args()
+
+    sram = bytearray(2 * (FB_ZBUF_ADDR + FB_FRAME))
+    for path, addr in [(args.frame0, FB_FRAME_ADDR_0), (args.frame1, FB_FRAME_ADDR_1)]:
+        if path:
+            frame = framebuffer_bytes(Image.open(path), args.fit, args.dither)
+            sram[2 * addr : 2 * (addr + FB_FRAME)] = frame
+    if args.zbuf:
+        zbuf = zbuf_bytes(args.zbuf)
+    else:
+        zbuf = ZBUF_FAR.to_bytes(2, "big") * FB_FRAME
+    sram[2 * FB_ZBUF_ADDR : 2 * (FB_ZBUF_ADDR + FB_FRAME)] = zbuf
+
+    with open(args.output, "wb") as output:
+        output.write(sram)
+
+
+def add_conversion_arguments(parser):
+    parser.add_argument(
+        "--fit",
+        choices=FIT_MODES,
+        default="crop",
+        help=f"how to bring images to {FB_WIDTH}x{FB_HEIGHT}: scale and crop the "
+        "overflow, scale and pad with black, or scale each axis separately",
+    )
+    parser.add_argument(
+        "--dither",
+        action="store_true",
+        help="ordered dithering before reducing to RGB565",
+    )
+
+
+# Converted frames are cached by source contents and conversion settings, so
+# uploading the same asset again skips decoding and resampling.
+def load_framebuffer(path, fit="crop", dither=False, cache_dir=FRAMEBUFFER_CACHE):
+    source = pathlib.Path(path).read_bytes()
+    if cache_dir is None:
+        return framebuffer_bytes(Image.open(io.BytesIO(source)), fit, dither)
+
+    settings = {
+        "fit": fit,
+        "dither": dither,
+        "size": [FB_WIDTH, FB_HEIGHT],
+        "pillow": PIL.__version__,
+        "version": FRAMEBUFFER_CACHE_VERSION,
+    }
+    hasher = hashlib.sha256(source)
+    hasher.update(json.dumps(settings, sort_keys=True).encode())
+    cache_file = pathlib.Path(cache_dir) / f"{hasher.hexdigest()}.bin"
+    try:
+        return cache_file.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    frame = framebuffer_bytes(Image.open(io.BytesIO(source)), fit, dither)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_bytes(frame)
+    os.replace(tmp_file, cache_file)
+    return frame
+
+
+# Packs a whole frame with per-band lookup tables instead of per-pixel Python.
+# Every word is
+# 15:11  Red
+#  10:5  Green
+#   4:0  Blue
+# stored high byte first.
+def framebuffer_bytes(image, fit="crop", dither=False):
+    red, green, blue = fit_image(image.convert("RGB"), fit).split()
+    if dither:
+        # Adding a threshold spread over [0, step) before truncating keeps the
+        # average colour of an area and breaks up banding
+        bayer = bayer_pattern()
+        red = ImageChops.add(red, bayer.point(lambda x: x // 2))
+        green = ImageChops.add(green, bayer.point(lambda x: x // 4))
+        blue = ImageChops.add(blue, bayer.point(lambda x: x // 2))
+    color_hi = ImageChops.add(
+        red.point(lambda x: x & 0b11111000), green.point(lambda x: x >> 5)
+    )
+    color_lo = ImageChops.add(
+        green.point(lambda x: (x << 3) & 0b11100000), blue.point(lambda x: x >> 3)
+    )
+    return Image.merge("LA", (color_hi, color_lo)).tobytes()
+
+
+# The inverse of framebuffer_bytes, widening each channel to 8 bits by
+# repeating its top bits
+def framebuffer_image(frame, width=FB_WIDTH):
+    size = (width, len(frame) // (2 * width))
+    color_hi, color_lo = Image.frombytes("LA", size, frame).split()
+    red = color_hi.point(lambda x: (x & 0b11111000) | (x >> 5))
+    green = ImageChops.add(
+        color_hi.point(lambda x: (x & 0b111) << 5 | (x & 0b111) >> 1),
+        color_lo.point(lambda x: (x >> 5) << 2),
+    )
+    blue = color_lo.point(lambda x: (x & 0b11111) << 3 | (x & 0b11111) >> 2)
+    return Image.merge("RGB", (red, green, blue))
+
+
+def fit_image(image, fit):
+    size = (FB_WIDTH, FB_HEIGHT)
+    if fit == "crop":
+        return ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    elif fit == "pad":
+        return ImageOps.pad(image, size, Image.Resampling.LANCZOS)
+    elif fit == "stretch":
+        return image.resize(size, Image.Resampling.LANCZOS)
+    raise ValueError(f"Unknown fit mode {fit}")
+
+
+def bayer_pattern():
+    pattern = bytes(
+        BAYER_4X4[(y % 4) * 4 + x % 4]
+        for y in range(FB_HEIGHT)
+        for x in range(FB_WIDTH)
+    )
+    return Image.frombytes("L", (FB_WIDTH, FB_HEIGHT), pattern)
+
+
+def zbuf_bytes(path):
+    image = Image.open(path)
+    if image.size != (FB_WIDTH, FB_HEIGHT):
+        raise SystemExit(
+            f"{path} is {image.size[0]}x{image.size[1]}, "
+            f"the z-buffer is {FB_WIDTH}x{FB_HEIGHT}"
+        )
+    if image.mode.startswith("I"):
+        # The I;16B packer saturates to 0..65535
+        return image.convert("I").tobytes("raw", "I;16B")
+    depth = image.convert("L")
+    return Image.merge("LA", (depth, depth)).tobytes()
+
+
+if __name__ == "__main__":
+    main()
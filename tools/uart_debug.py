@@ -1,92 +1,282 @@
 import argparse
+import asyncio
+import os
+import pathlib
+import statistics
 import time
 
-import serial
 from PIL import Image
+from sram_image import (
+    FB_FRAME,
+    FB_FRAME_ADDR_0,
+    FB_FRAME_ADDR_1,
+    FB_WIDTH,
+    FB_ZBUF_ADDR,
+    FRAMEBUFFER_CACHE,
+    add_conversion_arguments,
+    framebuffer_image,
+    load_framebuffer,
+)
+from wb_debug_client import BITS_PER_BYTE, SRAM_WORDS, open_device
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("serial_dev")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    write = commands.add_parser("write", help="show an image in a framebuffer")
+    write.add_argument("image", help="image to show, scaled to the framebuffer")
+    add_conversion_arguments(write)
+    write.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"always convert the image instead of using {FRAMEBUFFER_CACHE}",
+    )
+    write.add_argument(
+        "--frame", type=int, choices=[0, 1], default=0, help="framebuffer to write"
+    )
+    write.add_argument(
+        "--full",
+        action="store_true",
+        help="rewrite every pixel instead of only the ones that changed since the "
+        "last upload",
+    )
+    write.add_argument(
+        "--refresh-shadow",
+        action="store_true",
+        help="read the framebuffer back from the device and diff against that "
+        "instead of the last upload, reporting where the two disagree",
+    )
+
+    dump = commands.add_parser("dump", help="read a range of SRAM into a file")
+    dump.add_argument("output")
+    dump.add_argument(
+        "--region",
+        choices=DUMP_REGIONS,
+        default="frame0",
+        help="range to read unless --addr and --count are given",
+    )
+    dump.add_argument("--addr", type=lambda x: int(x, 0), help="first word to read")
+    dump.add_argument("--count", type=lambda x: int(x, 0), help="words to read")
+    dump.add_argument(
+        "--format",
+        choices=DUMP_FORMATS,
+        help="raw big-endian words, a PNG or a NumPy array of big-endian uint16, "
+        "from the output suffix if omitted",
+    )
+    dump.add_argument(
+        "--pixels",
+        choices=["rgb565", "depth"],
+        help="how a PNG shows each word, depth for the z-buffer and RGB565 "
+        "otherwise if omitted",
+    )
+    dump.add_argument(
+        "--width", type=int, default=FB_WIDTH, help="words per row for PNG and NumPy"
+    )
+    dump.add_argument(
+        "--window",
+        type=int,
+        default=READ_WINDOW,
+        help="reads in flight at once",
+    )
     args = parser.parse_args()
 
-    image = Image.open("/home/jwilcox/Pictures/test_image2.png")
-
-    with serial.Serial(args.serial_dev, 230400, timeout=1) as uart:
-        write_framebuffer(uart, image)
-        # read_framebuffer(uart)
-
-
-def write_framebuffer(uart, image):
-    uart.write(cmd_reg_write("A", 4))
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-
-    for y in range(240):
-        for x in range(320):
-            color = image.getpixel((x, y))
-            color_hi = (((color[0] >> 3) & 0b11111) << 3) | ((color[1] >> 5) & 0b111)
-            color_lo = (((color[1] >> 3) & 0b111) << 5) | ((color[2] >> 3) & 0b11111)
-            uart.write(cmd_reg_write("D", 2))
-            uart.write((color_hi).to_bytes())
-            uart.write((color_lo).to_bytes())
-
-            uart.write(cmd_execute("W", sel=0b1111, inc=True))
-            time.sleep(0.0005)
-
-
-def read_framebuffer(uart):
-    uart.write(cmd_reg_write("A", 4))
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-    uart.write((0).to_bytes())
-    uart.write(cmd_reg_write("D", 4))
-    uart.write((0x55).to_bytes())
-    uart.write((0x55).to_bytes())
-    uart.write((0x55).to_bytes())
-    uart.write((0x55).to_bytes())
-
-    for i in range(320 * 240):
-        uart.write(cmd_execute("R", sel=0b1111, inc=True))
-        uart.write(cmd_reg_read("D", 2))
-        result = uart.read(2)
-        print(result)
-
-
-OP_REG_READ = 0b01
-OP_REG_WRITE = 0b10
-OP_EXECUTE = 0b11
-
-
-# 7:6    (unused)
-# 5:3    Length
-#   2    D=0, A=1
-# 1:0    Opcode
-def cmd_reg_write(reg, len):
-    reg_bin = 1 if reg == "A" else 0
-    return (OP_REG_WRITE | reg_bin << 2 | len << 3).to_bytes()
-
-
-# 7:6    (unused)
-# 5:3    Length
-#   2    D=0, A=1
-# 1:0    Opcode
-def cmd_reg_read(reg, len):
-    reg_bin = 1 if reg == "A" else 0
-    return (OP_REG_READ | reg_bin << 2 | len << 3).to_bytes()
-
-
-# 7:4    Byte select
-#   3    Auto-increment A reg
-#   2    Read=0, Write=1
-# 1:0    Opcode
-def cmd_execute(op, inc, sel):
-    op_bin = 1 if op == "W" else 0
-    inc_bin = 1 if inc else 0
-    return (OP_EXECUTE | op_bin << 2 | inc_bin << 3 | sel << 4).to_bytes()
+    asyncio.run(run(args))
+
+
+async def run(args):
+    client = await open_device(args.serial_dev, BAUD_RATE)
+    try:
+        if args.command == "write":
+            await write_command(client, args)
+        else:
+            await dump_command(client, args)
+    finally:
+        await client.close()
+
+
+async def write_command(client, args):
+    cache_dir = None if args.no_cache else FRAMEBUFFER_CACHE
+    frame = load_framebuffer(args.image, args.fit, args.dither, cache_dir)
+    addr = FB_FRAME_ADDR_1 if args.frame else FB_FRAME_ADDR_0
+    shadow_file = shadow_path(args.serial_dev, addr)
+
+    shadow = None if args.full else load_shadow(shadow_file)
+    if args.refresh_shadow:
+        device = await read_words(client, addr, FB_FRAME, READ_WINDOW)
+        if shadow is not None:
+            stale = sum(end - start for start, end in dirty_spans(device, shadow))
+            print(f"Shadow disagreed with the device in {stale} pixels")
+        shadow = device
+    await write_framebuffer(client, frame, addr, shadow, shadow_file)
+
+
+async def dump_command(client, args):
+    addr, count = DUMP_REGIONS[args.region]
+    if args.addr is not None:
+        addr = args.addr
+    if args.count is not None:
+        count = args.count
+    if count <= 0 or addr < 0 or addr + count > SRAM_WORDS:
+        raise SystemExit(f"{count} words at {addr:#x} is outside the SRAM")
+    if args.window <= 0:
+        raise SystemExit("--window must be positive")
+    dump_format = args.format
+    if dump_format is None:
+        suffix = pathlib.Path(args.output).suffix.lstrip(".")
+        dump_format = suffix if suffix in DUMP_FORMATS else "raw"
+    if dump_format == "png" and count % args.width != 0:
+        raise SystemExit(f"{count} words is not a whole number of {args.width} rows")
+    pixels = args.pixels
+    if pixels is None:
+        pixels = "depth" if args.region == "zbuf" else "rgb565"
+
+    data = await read_words(client, addr, count, args.window)
+    if dump_format == "raw":
+        with open(args.output, "wb") as output:
+            output.write(data)
+    elif dump_format == "npy":
+        shape = (
+            (count // args.width, args.width) if count % args.width == 0 else (count,)
+        )
+        write_npy(args.output, data, shape)
+    else:
+        if pixels == "depth":
+            image = Image.frombytes("I;16B", (args.width, count // args.width), data)
+        else:
+            image = framebuffer_image(data, args.width)
+        image.save(args.output)
+
+
+# Version 1.0 of the .npy format: magic, header length, then a Python literal
+# describing the array, padded so the data starts 64-byte aligned
+def write_npy(path, data, shape):
+    header = repr({"descr": ">u2", "fortran_order": False, "shape": shape})
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    with open(path, "wb") as output:
+        output.write(NPY_MAGIC + len(header).to_bytes(2, "little"))
+        output.write(header.encode("latin1"))
+        output.write(data)
+
+
+# frame is the big-endian RGB565 buffer from load_framebuffer. The shadow is
+# what the last upload left in the same region, only changed pixels are sent.
+async def write_framebuffer(
+    client, frame, addr=FB_FRAME_ADDR_0, shadow=None, shadow_file=None
+):
+    spans = dirty_spans(frame, shadow)
+    pixels = sum(end - start for start, end in spans)
+    if shadow_file:
+        # An interrupted upload leaves the region unknown
+        shadow_file.unlink(missing_ok=True)
+    sent = client.bytes_sent
+    start = time.monotonic()
+    for span_start, span_end in spans:
+        await client.write_block(
+            addr + span_start, frame[2 * span_start : 2 * span_end]
+        )
+    sent = client.bytes_sent - sent
+    await client.sync()
+    elapsed = time.monotonic() - start
+    if shadow_file:
+        save_shadow(shadow_file, frame)
+    wire_time = sent * BITS_PER_BYTE / BAUD_RATE
+    print(
+        f"Uploaded {pixels} of {len(frame) // 2} pixels in {len(spans)} spans as "
+        f"{sent} bytes in {elapsed:.1f} s, wire limit {wire_time:.1f} s"
+    )
+
+
+def shadow_path(serial_dev, addr):
+    device = pathlib.Path(os.path.realpath(serial_dev)).name
+    return pathlib.Path(SHADOW_DIR) / f"{device}-{addr:06x}.bin"
+
+
+def load_shadow(shadow_file):
+    try:
+        shadow = shadow_file.read_bytes()
+    except FileNotFoundError:
+        return None
+    return shadow if len(shadow) == 2 * FB_FRAME else None
+
+
+def save_shadow(shadow_file, frame):
+    shadow_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = shadow_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_bytes(frame)
+    os.replace(tmp_file, shadow_file)
+
+
+# Word ranges [start, end) where frame differs from shadow. Reseeding A costs
+# 5 bytes while rewriting an unchanged pixel costs at least one, so spans
+# closer than that are merged.
+def dirty_spans(frame, shadow):
+    words = len(frame) // 2
+    if shadow is None or len(shadow) != len(frame):
+        return [(0, words)] if words else []
+
+    spans = []
+    for row in range(0, words, FB_WIDTH):
+        row_end = min(row + FB_WIDTH, words)
+        if frame[2 * row : 2 * row_end] == shadow[2 * row : 2 * row_end]:
+            continue
+        for i in range(row, row_end):
+            if frame[2 * i] == shadow[2 * i] and frame[2 * i + 1] == shadow[2 * i + 1]:
+                continue
+            if spans and i - spans[-1][1] <= SPAN_MERGE_GAP:
+                spans[-1][1] = i + 1
+            else:
+                spans.append([i, i + 1])
+    return [(start, end) for start, end in spans]
+
+
+# Reads count words starting at addr as big-endian bytes, keeping up to window
+# reads in flight so the link never waits out a round trip
+async def read_words(client, addr, count, window):
+    result = bytearray(2 * count)
+    chunk = min(READ_CHUNK, window)
+    in_flight = asyncio.Semaphore(max(window // chunk, 1))
+    round_trips = []
+
+    async def read_chunk(offset, size):
+        async with in_flight:
+            start = time.monotonic()
+            data = await client.read_block(addr + offset, size)
+            round_trips.append(time.monotonic() - start)
+        result[2 * offset : 2 * (offset + size)] = data
+
+    sent = client.bytes_sent
+    start = time.monotonic()
+    async with asyncio.TaskGroup() as tasks:
+        for offset in range(0, count, chunk):
+            tasks.create_task(read_chunk(offset, min(chunk, count - offset)))
+    elapsed = time.monotonic() - start
+
+    wire_time = (client.bytes_sent - sent) * BITS_PER_BYTE / BAUD_RATE
+    print(
+        f"Read {count} words in {elapsed:.1f} s, "
+        f"{len(result) / max(elapsed, 1e-6) / 1024:.1f} KiB/s, wire limit "
+        f"{wire_time:.1f} s, round trip {1000 * min(round_trips):.1f}/"
+        f"{1000 * statistics.median(round_trips):.1f}/"
+        f"{1000 * max(round_trips):.1f} ms min/median/max per {chunk} words"
+    )
+    return bytes(result)
+
+
+BAUD_RATE = 230400
+READ_WINDOW = 512
+READ_CHUNK = 256
+DUMP_REGIONS = {
+    "frame0": (FB_FRAME_ADDR_0, FB_FRAME),
+    "frame1": (FB_FRAME_ADDR_1, FB_FRAME),
+    "zbuf": (FB_ZBUF_ADDR, FB_FRAME),
+    "all": (0, SRAM_WORDS),
+}
+DUMP_FORMATS = ["raw", "png", "npy"]
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+SPAN_MERGE_GAP = 4
+SHADOW_DIR = os.environ.get("J63_SHADOW_DIR", os.path.expanduser("~/.cache/j63-shadow"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+import asyncio
+import collections
+import os
+import stat
+
+import serial
+
+OP_NOP = 0b00
+OP_REG_READ = 0b01
+OP_REG_WRITE = 0b10
+OP_EXECUTE = 0b11
+
+BITS_PER_BYTE = 10  # 8N1: start bit, 8 data bits, stop bit
+SRAM_WORDS = 1 << 20
+DEFAULT_TIMEOUT = 1.0
+SIMULATION_TIMEOUT = 60.0
+RECEIVE_SIZE = 65536
+
+
+# Operations address 16-bit words, the width of the SRAM bus. Block data and
+# 32-bit values are big-endian, high word at the lower address.
+#
+# Commands from every operation share the one link in the order they were
+# issued, so several operations can be in flight at once and the link never
+# waits on a round trip. The client mirrors A and D to skip register writes
+# that would not change anything and to shorten the ones that only change low
+# bytes. wb_debug answers reads in order, so responses are matched to
+# requests by position.
+#
+# A request fails once it is timeout past when the link could have delivered
+# its response, and no response bytes arrived for that long. With a baud rate
+# the client estimates when queued commands will be on the wire, as they can
+# sit in host and adapter buffers for seconds behind a large upload.
+class WishboneDebugClient:
+    def __init__(self, reader, writer, timeout=DEFAULT_TIMEOUT, baud_rate=None):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.byte_time = BITS_PER_BYTE / baud_rate if baud_rate else 0.0
+        # A serial port needs a separate transport for reading
+        self.read_transport = None
+
+        self.address = None
+        self.data = None
+        self.commands = bytearray()
+        self.flush_scheduled = False
+        self.bytes_sent = 0
+        self.line_clock = 0.0
+        self.responses = collections.deque()
+        self.last_response = 0.0
+        self.deadline = None
+        self.reader_task = asyncio.create_task(self.read_responses())
+
+    async def close(self):
+        self.flush()
+        self.reader_task.cancel()
+        self.writer.close()
+        if self.read_transport:
+            self.read_transport.close()
+
+    async def read16(self, addr):
+        return int.from_bytes(await self.read_block(addr, 1), "big")
+
+    async def read32(self, addr):
+        return int.from_bytes(await self.read_block(addr, 2), "big")
+
+    async def write16(self, addr, value):
+        await self.write_block(addr, value.to_bytes(2, "big"))
+
+    async def write32(self, addr, value):
+        await self.write_block(addr, value.to_bytes(4, "big"))
+
+    async def read_block(self, addr, count):
+        # A request for no bytes would never see its response arrive
+        if count < 0:
+            raise ValueError(f"Cannot read {count} words")
+        if count == 0:
+            return b""
+        commands = bytearray()
+        self.set_address(commands, addr)
+        commands += READ_WORD * count
+        self.address = (addr + count) & 0xFFFFFFFF
+        self.data = None
+        return await self.request(commands, 2 * count)
+
+    async def write_block(self, addr, data):
+        if len(data) % 2 != 0:
+            raise ValueError(f"{len(data)} bytes is not a whole number of words")
+        commands = bytearray()
+        self.set_address(commands, addr)
+        for i in range(0, len(data), 2):
+            self.set_data(commands, data[i] << 8 | data[i + 1])
+            commands += WRITE_WORD
+        self.address = (addr + len(data) // 2) & 0xFFFFFFFF
+        await self.send(commands)
+
+    async def fill(self, addr, count, value):
+        commands = bytearray()
+        self.set_address(commands, addr)
+        self.set_data(commands, value)
+        commands += WRITE_WORD * count
+        self.address = (addr + count) & 0xFFFFFFFF
+        await self.send(commands)
+
+    # Resolves once wb_debug has handled every command sent before it, and
+    # checks that none of them were lost on the way
+    async def sync(self):
+        expected = self.address
+        address = int.from_bytes(await self.request(READ_ADDRESS, 4), "big")
+        if expected is not None and address != expected:
+            raise ConnectionError(
+                f"wb_debug is at {address:#x} instead of {expected:#x}, "
+                "commands were lost"
+            )
+        return address
+
+    def set_address(self, commands, addr):
+        commands += register_write("A", self.address, addr, 0xFFFFFFFF)
+        self.address = addr
+
+    # Only D(15:0) reaches the bus
+    def set_data(self, commands, value):
+        commands += register_write("D", self.data, value, 0xFFFF)
+        self.data = value & 0xFFFF
+
+    async def send(self, commands):
+        self.queue(commands)
+        await self.writer.drain()
+
+    async def request(self, commands, size):
+        future = asyncio.get_running_loop().create_future()
+        self.queue(commands)
+        deadline = self.line_clock + size * self.byte_time + self.timeout
+        self.responses.append((size, bytearray(), future, deadline))
+        if self.deadline and self.deadline.when() is None:
+            self.deadline.reschedule(self.response_deadline())
+        await self.writer.drain()
+        return await future
+
+    def response_deadline(self):
+        if not self.responses:
+            return None
+        return max(self.responses[0][3], self.last_response + self.timeout)
+
+    # Commands queued in the same event loop iteration go out as one write
+    def queue(self, commands):
+        now = asyncio.get_running_loop().time()
+        self.line_clock = max(self.line_clock, now) + len(commands) * self.byte_time
+        self.commands += commands
+        self.bytes_sent += len(commands)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.commands:
+            self.writer.write(bytes(self.commands))
+            self.commands.clear()
+
+    async def read_responses(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                async with asyncio.timeout(None) as self.deadline:
+                    self.deadline.reschedule(self.response_deadline())
+                    data = await self.reader.read(RECEIVE_SIZE)
+            except TimeoutError:
+                self.fail(TimeoutError("wb_debug stopped responding"))
+                continue
+            except OSError as error:
+                self.fail(ConnectionError(f"wb_debug link failed: {error}"))
+                return
+            finally:
+                self.deadline = None
+            if not data:
+                self.fail(ConnectionError("wb_debug link closed"))
+                return
+            self.last_response = loop.time()
+            self.dispatch(data)
+
+    def dispatch(self, data):
+        pos = 0
+        while pos < len(data) and self.responses:
+            size, buffer, future, _ = self.responses[0]
+            take = min(size - len(buffer), len(data) - pos)
+            buffer += data[pos : pos + take]
+            pos += take
+            if len(buffer) == size:
+                self.responses.popleft()
+                if not future.done():
+                    future.set_result(bytes(buffer))
+
+    # Nothing is known about the device after a failure, so the next
+    # operation writes A and D in full
+    def fail(self, error):
+        while self.responses:
+            _, _, future, _ = self.responses.popleft()
+            if not future.done():
+                future.set_exception(error)
+        self.address = None
+        self.data = None
+
+
+async def open_serial(serial_dev, baud_rate, timeout=DEFAULT_TIMEOUT):
+    # pyserial puts the port in raw mode at the right speed, asyncio takes
+    # over the file descriptor from there
+    with serial.Serial(serial_dev, baud_rate) as uart:
+        read_file = os.fdopen(os.dup(uart.fileno()), "rb", buffering=0)
+        write_file = os.fdopen(os.dup(uart.fileno()), "wb", buffering=0)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    read_transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), read_file
+    )
+    write_transport, write_protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, write_file
+    )
+    writer = asyncio.StreamWriter(write_transport, write_protocol, reader, loop)
+    client = WishboneDebugClient(reader, writer, timeout, baud_rate)
+    client.read_transport = read_transport
+    return client
+
+
+# There is no line rate to pace deadlines by, and a simulation can take a long
+# time to work through a large upload
+async def open_socket(path, timeout=SIMULATION_TIMEOUT):
+    reader, writer = await asyncio.open_unix_connection(path)
+    return WishboneDebugClient(reader, writer, timeout)
+
+
+# A serial port, or the socket tb_wb_debug_cosim listens on
+async def open_device(path, baud_rate):
+    if stat.S_ISSOCK(os.stat(path).st_mode):
+        return await open_socket(path)
+    return await open_serial(path, baud_rate)
+
+
+# Writes the bytes of value that differ from current, the register's known
+# contents or None. A write of length n sets the low n bytes.
+def register_write(reg, current, value, mask):
+    if current is None:
+        changed = mask
+    else:
+        changed = (current ^ value) & mask
+    length = (changed.bit_length() + 7) // 8
+    if length == 0:
+        return b""
+    return cmd_reg_write(reg, length) + (value & ((1 << 8 * length) - 1)).to_bytes(
+        length, "big"
+    )
+
+
+# 7:6    (unused)
+# 5:3    Length
+#   2    D=0, A=1
+# 1:0    Opcode
+def cmd_reg_write(reg, len):
+    reg_bin = 1 if reg == "A" else 0
+    return (OP_REG_WRITE | reg_bin << 2 | len << 3).to_bytes()
+
+
+# 7:6    (unused)
+# 5:3    Length
+#   2    D=0, A=1
+# 1:0    Opcode
+#
+# wb_debug ignores commands until it has handed the last byte of a register
+# read to the UART, which is about when the next command byte arrives at line
+# rate. Pad with a NOP per extra byte so that only a NOP can be lost.
+def cmd_reg_read(reg, len):
+    reg_bin = 1 if reg == "A" else 0
+    padding = OP_NOP.to_bytes() * (len - 1)
+    return (OP_REG_READ | reg_bin << 2 | len << 3).to_bytes() + padding
+
+
+# 7:4    Byte select
+#   3    Auto-increment A reg
+#   2    Read=0, Write=1
+# 1:0    Opcode
+def cmd_execute(op, inc, sel):
+    op_bin = 1 if op == "W" else 0
+    inc_bin = 1 if inc else 0
+    return (OP_EXECUTE | op_bin << 2 | inc_bin << 3 | sel << 4).to_bytes()
+
+
+READ_WORD = cmd_execute("R", sel=0b1111, inc=True) + cmd_reg_read("D", 2)
+WRITE_WORD = cmd_execute("W", sel=0b1111, inc=True)
+READ_ADDRESS = cmd_reg_read("A", 4)
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import random
+import time
+
+from sram_image import FB_FRAME, FB_FRAME_ADDR_1, load_framebuffer
+from uart_debug import READ_WINDOW, read_words, write_framebuffer
+from wb_debug_client import open_socket
+
+CONNECT_TIMEOUT = 60
+CONNECT_RETRY = 0.1
+TEST_IMAGE = "hw/gpu/assets/colorbars.png"
+SCRATCH_ADDR = 0x80000
+SCRATCH_WORDS = 0x10000
+BLOCK_WORDS = 1000
+CONCURRENT_WORDS = 32
+CHANGED_PIXELS = 50
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the host debug tools against wb_debug in "
+        "tb_wb_debug_cosim and check what they read back"
+    )
+    parser.add_argument("socket", help="socket the simulation listens on")
+    parser.add_argument(
+        "--image", default=TEST_IMAGE, help="image to upload as a framebuffer"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = await connect(args.socket)
+    try:
+        await check_blocks(client, rng)
+        await check_concurrent(client, rng)
+        await check_framebuffer(client, rng, args.image)
+        await client.sync()
+    finally:
+        await client.close()
+    print("wb_debug cosim passed")
+
+
+# The simulation only starts listening once nvc has loaded the design
+async def connect(path):
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while True:
+        try:
+            return await open_socket(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise SystemExit(f"No simulation listening on {path}")
+            await asyncio.sleep(CONNECT_RETRY)
+
+
+async def check_blocks(client, rng):
+    addr = SCRATCH_ADDR + rng.randrange(SCRATCH_WORDS - BLOCK_WORDS)
+    data = bytearray(rng.randbytes(2 * BLOCK_WORDS))
+    await client.write_block(addr, data)
+    expect("write_block", await client.read_block(addr, BLOCK_WORDS), data)
+
+    start = rng.randrange(BLOCK_WORDS // 2)
+    count = rng.randrange(1, BLOCK_WORDS // 2)
+    value = rng.getrandbits(16)
+    await client.fill(addr + start, count, value)
+    data[2 * start : 2 * (start + count)] = value.to_bytes(2, "big") * count
+    expect("fill", await client.read_block(addr, BLOCK_WORDS), data)
+
+    value = rng.getrandbits(32)
+    await client.write32(addr, value)
+    expect("write32", await client.read32(addr), value)
+
+
+# Every operation is issued before the first response arrives, and each read
+# has to see the write queued just before it
+async def check_concurrent(client, rng):
+    addrs = rng.sample(
+        range(SCRATCH_ADDR, SCRATCH_ADDR + SCRATCH_WORDS), CONCURRENT_WORDS
+    )
+    values = [rng.getrandbits(16) for _ in addrs]
+    results = await asyncio.gather(
+        *(
+            operation
+            for addr, value in zip(addrs, values)
+            for operation in (client.write16(addr, value), client.read16(addr))
+        )
+    )
+    expect("concurrent", results[1::2], values)
+
+
+async def check_framebuffer(client, rng, image):
+    frame = load_framebuffer(image, cache_dir=None)
+    await write_framebuffer(client, frame, FB_FRAME_ADDR_1)
+    readback = await read_words(client, FB_FRAME_ADDR_1, FB_FRAME, READ_WINDOW)
+    expect("framebuffer upload", readback, frame)
+
+    changed = bytearray(frame)
+    for pixel in rng.sample(range(FB_FRAME), CHANGED_PIXELS):
+        changed[2 * pixel : 2 * pixel + 2] = rng.randbytes(2)
+    await write_framebuffer(client, changed, FB_FRAME_ADDR_1, shadow=frame)
+    readback = await read_words(client, FB_FRAME_ADDR_1, FB_FRAME, READ_WINDOW)
+    expect("framebuffer update", readback, changed)
+
+
+def expect(name, actual, expected):
+    if actual == expected:
+        print(f"{name}: ok")
+        return
+    if isinstance(expected, (bytes, bytearray)):
+        word = next(
+            (i // 2 for i, (a, b) in enumerate(zip(actual, expected)) if a != b),
+            min(len(actual), len(expected)) // 2,
+        )
+        raise SystemExit(
+            f"{name}: word {word} is "
+            f"{actual[2 * word : 2 * word + 2].hex()} instead of "
+            f"{expected[2 * word : 2 * word + 2].hex()}"
+        )
+    raise SystemExit(f"{name}: got {actual} instead of {expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import array
+import collections
+import os
+import pty
+import select
+import sys
+import time
+import tty
+
+from wb_debug_client import (
+    BITS_PER_BYTE,
+    OP_EXECUTE,
+    OP_REG_READ,
+    OP_REG_WRITE,
+    SRAM_WORDS,
+)
+
+DEFAULT_BAUD_RATE = 230400
+RECEIVE_SIZE = 4096
+SLEEP_SLACK = 0.001
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Emulate wb_debug_uart and the SRAM behind it on a pty, so "
+        "host tools can run without the board"
+    )
+    parser.add_argument(
+        "--baud",
+        type=int,
+        default=DEFAULT_BAUD_RATE,
+        help="line rate the UART timing is modelled at",
+    )
+    parser.add_argument(
+        "--throttle",
+        action="store_true",
+        help="pace commands and responses at --baud in real time",
+    )
+    parser.add_argument("--link", help="symlink to create to the pty")
+    parser.add_argument(
+        "--image", help="raw SRAM image of big-endian words to start with"
+    )
+    args = parser.parse_args()
+
+    emulator = WishboneDebugEmulator(args.baud)
+    if args.image:
+        emulator.load_image(args.image)
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if args.link:
+        if os.path.lexists(args.link):
+            os.unlink(args.link)
+        os.symlink(path, args.link)
+        path = args.link
+    print(f"wb_debug emulator on {path}", flush=True)
+
+    try:
+        # Keeping the slave open stops reads from failing between clients
+        serve(emulator, master, args.throttle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link:
+            os.unlink(args.link)
+        os.close(slave)
+        os.close(master)
+
+
+# Follows wb_debug's state machine, with wb_sram's single-cycle SRAM access
+# behind it. Byte select is accepted and ignored like on the board, which
+# ties both byte enables low.
+#
+# Time is modelled at the line rate: every received byte has an arrival time
+# and every response byte a time it reaches the host. wb_debug drops command
+# bytes until it has handed the last byte of a register read to the UART
+# transmitter, so those are dropped here too.
+class WishboneDebugEmulator:
+    def __init__(self, baud_rate=DEFAULT_BAUD_RATE):
+        self.byte_time = BITS_PER_BYTE / baud_rate
+        self.sram = array.array("H", bytes(2 * SRAM_WORDS))
+        self.address = 0
+        self.data = 0
+        self.data_out = 0
+        self.active_cmd = 0
+        self.byte_pointer = 0
+        self.writing_reg = False
+        self.deaf_until = 0.0
+        self.tx_free = 0.0
+        self.lost = 0
+
+    def load_image(self, path):
+        with open(path, "rb") as image:
+            words = array.array("H", image.read(2 * SRAM_WORDS))
+        if sys.byteorder == "little":
+            words.byteswap()
+        self.sram[: len(words)] = words
+
+    # Returns the response bytes as (time, byte) pairs
+    def receive(self, byte, arrival):
+        if arrival <= self.deaf_until:
+            # Clients pad reads with NOPs so that only those land here
+            if byte != 0:
+                self.lost += 1
+            return []
+
+        if self.writing_reg:
+            self.byte_pointer = (self.byte_pointer - 1) & 0b111
+            byte_index = self.byte_pointer
+            if self.active_cmd & 0b100:
+                self.address = set_byte32(self.address, byte_index, byte)
+            else:
+                self.data = set_byte32(self.data, byte_index, byte)
+            if self.byte_pointer == 0:
+                self.writing_reg = False
+            return []
+
+        length = (byte >> 3) & 0b111
+        opcode = byte & 0b11
+        if opcode == OP_REG_READ:
+            return self.read_reg(byte, length, arrival)
+        elif opcode == OP_REG_WRITE:
+            self.active_cmd = byte
+            self.byte_pointer = length
+            self.writing_reg = True
+        elif opcode == OP_EXECUTE:
+            self.execute(byte)
+        return []
+
+    # Bytes go out from index length-1 down to 0. Indices past the register,
+    # which a length of 0 or over 4 produces, repeat the previous byte.
+    def read_reg(self, cmd, length, arrival):
+        value = self.address if cmd & 0b100 else self.data
+        handoff = max(arrival, self.tx_free)
+        response = []
+        for byte_index in range((length - 1) & 0b111, -1, -1):
+            if byte_index < 4:
+                self.data_out = (value >> (8 * byte_index)) & 0xFF
+            response.append((handoff + self.byte_time, self.data_out))
+            self.deaf_until = handoff
+            handoff += self.byte_time
+        self.tx_free = handoff
+        return response
+
+    def execute(self, cmd):
+        addr = self.address & (SRAM_WORDS - 1)
+        if cmd & 0b100:
+            self.sram[addr] = self.data & 0xFFFF
+        else:
+            self.data = self.sram[addr]
+        if cmd & 0b1000:
+            self.address = (self.address + 1) & 0xFFFFFFFF
+
+
+def set_byte32(value, byte_index, byte):
+    if byte_index >= 4:
+        return value
+    shift = 8 * byte_index
+    return (value & ~(0xFF << shift)) | byte << shift
+
+
+# Bytes that were already waiting when the previous one arrived are
+# back-to-back on the line. Without the throttle, a pause between writes from
+# the client counts as the line going idle until the emulator has caught up.
+def serve(emulator, fd, throttle):
+    byte_time = emulator.byte_time
+    line_time = 0.0
+    back_to_back = False
+    responses = collections.deque()
+    lost = 0
+
+    while True:
+        timeout = None
+        if responses:
+            timeout = max(responses[0][0] - time.monotonic(), 0) if throttle else 0
+        readable, _, _ = select.select([fd], [], [], timeout)
+        send_responses(fd, responses, throttle)
+        if not readable:
+            back_to_back = False
+            continue
+
+        now = time.monotonic()
+        for byte in os.read(fd, RECEIVE_SIZE):
+            if throttle:
+                arrival = max(line_time + byte_time, now)
+                if arrival > time.monotonic() + SLEEP_SLACK:
+                    send_responses(fd, responses, throttle)
+                    time.sleep(max(arrival - time.monotonic(), 0))
+            elif back_to_back:
+                arrival = line_time + byte_time
+            else:
+                arrival = max(line_time, emulator.tx_free) + byte_time
+            line_time = arrival
+            back_to_back = True
+            responses.extend(emulator.receive(byte, arrival))
+        if not throttle:
+            back_to_back = bool(select.select([fd], [], [], 0)[0])
+
+        if emulator.lost != lost:
+            lost = emulator.lost
+            print(f"Lost {lost} command bytes so far", file=sys.stderr)
+
+
+def send_responses(fd, responses, throttle):
+    now = time.monotonic()
+    due = bytearray()
+    while responses and (not throttle or responses[0][0] <= now):
+        due.append(responses.popleft()[1])
+    if due:
+        os.write(fd, due)
+
+
+if __name__ == "__main__":
+    main()